@@ -1,3 +1,9 @@
+from gif import edit, transform
+from gif.async_reader import AsyncReader
+from gif.batch import DecodeBatch, DecodedFile, decode_many
+from gif.cache import DecodeCache, DiskDecodeCache
+from gif.errors import LimitExceededError
+from gif.frame_index import FrameIndex, FrameIndexEntry
 from gif.image import (
     AnimationExtension,
     ApplicationExtension,
@@ -16,32 +22,54 @@ from gif.image import (
     Version,
     XMPDataExtension,
 )
-from gif.lzw import LZWDecoder, LZWEncoder
+from gif.lzw import LZWDecoder, LZWEncoder, LZWStats
+from gif.optimizer import optimize
+from gif.palette import Palette
 from gif.reader import Reader
-from gif.writer import Writer
+from gif.renderer import AnimationRenderer, Frame, Renderer, get_frames
+from gif.writer import AnimationBuilder, Writer
 
 from .__about__ import __version__
 
 __all__ = [
     "__version__",
+    "AnimationBuilder",
     "AnimationExtension",
+    "AnimationRenderer",
     "ApplicationExtension",
+    "AsyncReader",
     "Block",
     "BlockType",
     "CommentExtension",
+    "DecodeBatch",
+    "DecodeCache",
+    "DecodedFile",
+    "DiskDecodeCache",
     "DisposalMethod",
     "Extension",
+    "Frame",
+    "FrameIndex",
+    "FrameIndexEntry",
     "GraphicControlExtension",
     "ICCColorProfileExtension",
     "Image",
     "LZWDecoder",
+    "LimitExceededError",
     "LZWEncoder",
+    "LZWStats",
     "NetscapeExtension",
+    "Palette",
     "PlainTextExtension",
     "Reader",
+    "Renderer",
     "Trailer",
     "UnknownBlock",
     "Version",
     "Writer",
     "XMPDataExtension",
+    "decode_many",
+    "edit",
+    "get_frames",
+    "optimize",
+    "transform",
 ]
@@ -0,0 +1,164 @@
+# Copyright 2018 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License version 3, as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranties of MERCHANTABILITY,
+# SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Lesser
+# General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+from collections.abc import AsyncIterator, Sequence
+
+from gif.image import Block, GraphicControlExtension, Image
+from gif.lzw import LZWDecoder
+from gif.reader import Reader
+from gif.renderer import Frame, _make_frame
+
+__all__ = ["AsyncReader"]
+
+
+class AsyncReader:
+    """
+    GIF decoder that reads from asyncio streams.
+
+    Blocks and frames can be iterated over while the data is still being read,
+    and the limits of Reader are checked as each chunk arrives.
+
+    If offload_decoding is set, LZW decoding is run in executor (the event
+    loop's default executor if None) so the event loop is not blocked.
+    """
+
+    def __init__(
+        self,
+        max_width: int | None = None,
+        max_height: int | None = None,
+        max_frames: int | None = None,
+        max_decoded_bytes: int | None = None,
+        max_frame_pixels: int | None = None,
+        max_compression_ratio: float | None = None,
+        offload_decoding: bool = False,
+        executor=None,
+        chunk_size: int = 65536,
+    ) -> None:
+        self.reader = Reader(
+            max_width=max_width,
+            max_height=max_height,
+            max_frames=max_frames,
+            max_decoded_bytes=max_decoded_bytes,
+            max_frame_pixels=max_frame_pixels,
+            max_compression_ratio=max_compression_ratio,
+        )
+        self.offload_decoding = offload_decoding
+        self.executor = executor
+        self.chunk_size = chunk_size
+
+        # Set when no more blocks will be read
+        self.finished = False
+        self.error: Exception | None = None
+
+        # Event to wake iterators when blocks are added (created on first use as
+        # it needs a running event loop)
+        self._changed: asyncio.Event | None = None
+
+    def feed(self, data: bytes) -> None:
+        try:
+            self.reader.feed(data)
+        except Exception as e:
+            self.error = e
+            self.finished = True
+            raise
+        finally:
+            if self.reader.is_complete() or self.reader.has_unknown_block():
+                self.finished = True
+            self._notify()
+
+    async def feed_from(self, stream: asyncio.StreamReader) -> None:
+        """
+        Read from stream until the GIF trailer or end of the stream.
+        """
+        while not self.finished:
+            data = await stream.read(self.chunk_size)
+            if data == b"":
+                break
+            self.feed(data)
+        self.finished = True
+        self._notify()
+
+    async def blocks(self) -> AsyncIterator[Block]:
+        """
+        Iterate over blocks as they are read.
+        """
+        i = 0
+        while True:
+            while i < len(self.reader.blocks):
+                yield self.reader.blocks[i]
+                i += 1
+            if self.error is not None:
+                raise self.error
+            if self.finished:
+                return
+            await self._wait()
+
+    async def frames(self) -> AsyncIterator[Frame]:
+        """
+        Iterate over frames as their images are read.
+        """
+        control = None
+        async for block in self.blocks():
+            if isinstance(block, GraphicControlExtension):
+                control = block
+            elif isinstance(block, Image):
+                yield _make_frame(block, control)
+                control = None
+
+    async def decode(self, image: Image) -> Sequence[int]:
+        """
+        Get the pixels in image.
+        """
+        if not self.offload_decoding:
+            return image.get_pixels()
+        # feed() can grow the reader's buffer while the executor is decoding, so
+        # the data is copied out of it first
+        data = image.get_lzw_data()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, _decode_lzw, image, data)
+
+    async def decode_frames(self) -> AsyncIterator[tuple[Frame, Sequence[int]]]:
+        """
+        Iterate over frames and their pixels as their images are read.
+        """
+        async for frame in self.frames():
+            pixels = await self.decode(frame.image)
+            yield (frame, pixels)
+
+    def _notify(self) -> None:
+        if self._changed is not None:
+            self._changed.set()
+
+    async def _wait(self) -> None:
+        if self._changed is None:
+            self._changed = asyncio.Event()
+        self._changed.clear()
+        await self._changed.wait()
+
+
+def _decode_lzw(image: Image, data: bytes) -> Sequence[int]:
+    # Decode with a new decoder, as the reader's pool is only used from the
+    # event loop's thread
+    if image.lzw_min_code_size >= 12:
+        print("Image has invalid code size of %d" % image.lzw_min_code_size)
+        return bytearray()
+    decoder = LZWDecoder(
+        image.lzw_min_code_size,
+        max_values=image.max_pixels,
+        max_ratio=image.max_compression_ratio,
+        expected_values=image.width * image.height,
+    )
+    decoder.feed(data)
+    return decoder.values
@@ -0,0 +1,348 @@
+# Copyright 2018 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License version 3, as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranties of MERCHANTABILITY,
+# SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Lesser
+# General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+from collections.abc import Sequence
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from typing_extensions import Self
+
+from gif.cache import DecodeCache, DiskDecodeCache
+from gif.image import Image
+from gif.reader import Reader
+from gif.renderer import Renderer, get_frames
+
+__all__ = ["DecodeBatch", "DecodedFile", "decode_many"]
+
+# Position and size of a frame
+_Rect = tuple[int, int, int, int]
+
+# What a worker returns for each file: offset of its pixels in the chunk, screen
+# size, frame rects, delay times and error
+_Result = tuple[int, int, int, list[_Rect], list[int], str | None]
+
+# Most chunks given to each worker, so the number of shared memory segments
+# (each holding a file descriptor until the batch is closed) stays small
+_MAX_CHUNKS_PER_WORKER = 4
+
+# Disk caches used by all files decoded in a worker process
+_disk_caches: dict[str, DiskDecodeCache] = {}
+
+
+class DecodedFile:
+    """
+    Pixels of a file decoded by decode_many(), stored in shared memory.
+
+    In "index" mode each frame is the color indexes of an image, with the
+    position and size given in frame_rects. In "rgba" mode each frame is the
+    composited screen as RGBA bytes. If the file could not be decoded, error
+    is set and there are no frames.
+    """
+
+    def __init__(
+        self,
+        mode: str,
+        buffer: memoryview | None,
+        offset: int,
+        width: int,
+        height: int,
+        frame_rects: list[_Rect],
+        delay_times: list[int],
+        error: str | None,
+    ) -> None:
+        self.mode = mode
+        self.width = width
+        self.height = height
+        self.frame_rects = frame_rects
+        self.delay_times = delay_times
+        self.error = error
+        self._buffer = buffer
+
+        # Offset of each frame in buffer, and the end of the last one
+        self._frame_offsets = [offset]
+        for i in range(len(frame_rects)):
+            self._frame_offsets.append(
+                self._frame_offsets[-1] + self._get_frame_size(i)
+            )
+
+    def __len__(self) -> int:
+        return len(self.frame_rects)
+
+    def get_frame(self, frame: int) -> memoryview:
+        """
+        Get the pixels of a frame. The view must be released before the batch
+        is closed.
+        """
+        assert self._buffer is not None
+        return self._buffer[self._frame_offsets[frame] : self._frame_offsets[frame + 1]]
+
+    def _get_frame_size(self, frame: int) -> int:
+        if self.mode == "rgba":
+            return self.width * self.height * 4
+        (_, _, width, height) = self.frame_rects[frame]
+        return width * height
+
+
+class DecodeBatch(Sequence[DecodedFile]):
+    """
+    Files decoded by decode_many(), in the order they were given. The shared
+    memory is freed when the batch is closed.
+    """
+
+    def __init__(self, files: list[DecodedFile], segments: list[SharedMemory]) -> None:
+        self.files = files
+        self._segments = segments
+
+    def __len__(self) -> int:
+        return len(self.files)
+
+    def __getitem__(self, index):
+        return self.files[index]
+
+    def __enter__(self) -> "Self":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        segments = self._segments
+        self._segments = []
+        for segment in segments:
+            # Keep going if one can't be unlinked so the rest aren't leaked
+            try:
+                segment.unlink()
+            except OSError:
+                pass
+            segment.close()
+
+
+def decode_many(
+    sources: Sequence,
+    workers: int | None = None,
+    mode: str = "rgba",
+    chunk_size: int = 64,
+    max_width: int | None = None,
+    max_height: int | None = None,
+    max_frames: int | None = None,
+    max_decoded_bytes: int | None = None,
+    max_frame_pixels: int | None = None,
+    max_compression_ratio: float | None = None,
+    cache_directory: str | None = None,
+) -> DecodeBatch:
+    """
+    Decode many GIFs, each given as a path or the file contents.
+
+    Files are decoded in chunks of at least chunk_size using a pool of worker
+    processes (one per CPU if None), which write the pixels into shared
+    memory instead of sending them back. Chunks are made larger so there are
+    only a few for each worker, as each chunk's memory stays open until the
+    batch is closed. mode is "index" for the color
+    indexes of each image or "rgba" for composited frames.
+
+    Files that can't be read or exceed the limits (see Reader) have their
+    error set rather than stopping the batch.
+
+    If cache_directory is set, the workers share a DiskDecodeCache there so
+    images repeated between files are only decoded once.
+    """
+    assert mode in ("index", "rgba")
+    limits = (
+        max_width,
+        max_height,
+        max_frames,
+        max_decoded_bytes,
+        max_frame_pixels,
+        max_compression_ratio,
+    )
+    n_workers = workers if workers is not None else os.cpu_count() or 1
+    max_chunks = max(n_workers, 1) * _MAX_CHUNKS_PER_WORKER
+    chunk_size = max(chunk_size, -(-len(sources) // max_chunks))
+    chunks = [
+        (list(sources[i : i + chunk_size]), mode, limits, cache_directory)
+        for i in range(0, len(sources), chunk_size)
+    ]
+
+    executor = None
+    if (workers is None or workers > 1) and len(chunks) > 1:
+        # Start the resource tracker before the workers so they share it,
+        # otherwise each worker's tracker frees its segments when it exits
+        resource_tracker.ensure_running()
+        executor = ProcessPoolExecutor(max_workers=workers)
+    files: list[DecodedFile] = []
+    segments: list[SharedMemory] = []
+    futures: list[Future] = []
+    if executor is not None:
+        futures = [executor.submit(_decode_chunk, chunk) for chunk in chunks]
+    # Number of chunks whose segments have been added to segments
+    n_used = 0
+    try:
+        for i, chunk in enumerate(chunks):
+            if executor is not None:
+                (name, results) = futures[i].result()
+            else:
+                (name, results) = _decode_chunk(chunk)
+            buffer = None
+            if name is not None:
+                segment = SharedMemory(name)
+                segments.append(segment)
+                buffer = segment.buf
+            n_used = i + 1
+            for offset, width, height, rects, delay_times, error in results:
+                files.append(
+                    DecodedFile(
+                        mode,
+                        buffer,
+                        offset,
+                        width,
+                        height,
+                        rects,
+                        delay_times,
+                        error,
+                    )
+                )
+    except BaseException:
+        # Close the segments in use first, so there are file descriptors to
+        # attach to the others
+        DecodeBatch([], segments).close()
+        # Chunks that were decoded but not used yet have segments too
+        for future in futures[n_used:]:
+            future.cancel()
+        for future in futures[n_used:]:
+            if future.cancelled() or future.exception() is not None:
+                continue
+            (name, _) = future.result()
+            if name is not None:
+                _unlink(name)
+        raise
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    return DecodeBatch(files, segments)
+
+
+def _decode_chunk(
+    args: tuple[list, str, tuple, str | None],
+) -> tuple[str | None, list[_Result]]:
+    (sources, mode, limits, cache_directory) = args
+    # A new cache for each chunk, so images cached by earlier calls with other
+    # limits aren't used
+    decode_cache: DecodeCache = DecodeCache()
+    if cache_directory is not None:
+        if cache_directory not in _disk_caches:
+            _disk_caches[cache_directory] = DiskDecodeCache(cache_directory)
+        decode_cache = _disk_caches[cache_directory]
+    outputs = []
+    results: list[_Result] = []
+    offset = 0
+    for source in sources:
+        try:
+            (width, height, rects, delay_times, pixels) = _decode_file(
+                source, mode, limits, decode_cache
+            )
+        # Any error in a file is reported for that file rather than stopping the
+        # batch
+        except Exception as e:  # noqa: BLE001
+            results.append((offset, 0, 0, [], [], "%s: %s" % (type(e).__name__, e)))
+            continue
+        results.append((offset, width, height, rects, delay_times, None))
+        outputs.extend(pixels)
+        offset += sum(len(frame) for frame in pixels)
+
+    if offset == 0:
+        return (None, results)
+    segment = SharedMemory(create=True, size=offset)
+    buffer = segment.buf
+    assert buffer is not None
+    offset = 0
+    for frame in outputs:
+        buffer[offset : offset + len(frame)] = frame
+        offset += len(frame)
+    del buffer
+    name = segment.name
+    segment.close()
+    return (name, results)
+
+
+def _unlink(name: str) -> None:
+    # Free a segment that was never attached to, keeping going on errors so the
+    # other segments aren't leaked
+    try:
+        segment = SharedMemory(name)
+    except OSError:
+        return
+    segment.close()
+    try:
+        segment.unlink()
+    except OSError:
+        pass
+
+
+def _decode_file(
+    source, mode: str, limits: tuple, decode_cache: DecodeCache
+) -> tuple[int, int, list[_Rect], list[int], list[bytes]]:
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            data = f.read()
+    else:
+        data = bytes(source)
+    (
+        max_width,
+        max_height,
+        max_frames,
+        max_decoded_bytes,
+        max_frame_pixels,
+        max_compression_ratio,
+    ) = limits
+    reader = Reader(
+        max_width=max_width,
+        max_height=max_height,
+        max_frames=max_frames,
+        max_decoded_bytes=max_decoded_bytes,
+        max_frame_pixels=max_frame_pixels,
+        max_compression_ratio=max_compression_ratio,
+        decode_cache=decode_cache,
+    )
+    reader.feed(data)
+    if not reader.is_gif():
+        raise ValueError("Not a GIF file")
+
+    frames = get_frames(reader.blocks)
+    delay_times = [frame.delay_time for frame in frames]
+    pixels = []
+    if mode == "index":
+        rects = []
+        for frame in frames:
+            pixels.append(_get_indexes(frame.image))
+            image = frame.image
+            rects.append((image.left, image.top, image.width, image.height))
+    else:
+        rects = [(0, 0, reader.width, reader.height)] * len(frames)
+        renderer = Renderer(reader.width, reader.height, reader.color_table)
+        for frame in frames:
+            renderer.render(frame)
+            pixels.append(renderer.get_pixels())
+    return (reader.width, reader.height, rects, delay_times, pixels)
+
+
+def _get_indexes(image: Image) -> bytes:
+    # Missing pixels are set to zero
+    n_pixels = image.width * image.height
+    pixels = bytes(image.get_pixels())[:n_pixels]
+    return pixels + bytes(n_pixels - len(pixels))
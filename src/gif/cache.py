@@ -0,0 +1,281 @@
+# Copyright 2018 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License version 3, as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranties of MERCHANTABILITY,
+# SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Lesser
+# General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import mmap
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+__all__ = ["DecodeCache", "DiskDecodeCache"]
+
+# Age in seconds after which temporary files left by crashed writers are removed
+_STALE_TEMPORARY_AGE = 3600
+
+
+class _Stripe:
+    # Part of a DecodeCache's entries, with its own lock
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.entries: OrderedDict[bytes, bytes] = OrderedDict()
+        self.size = 0
+        self.n_hits = 0
+        self.n_misses = 0
+
+
+class DecodeCache:
+    """
+    Cache of decoded image pixels, keyed by Image.get_lzw_hash().
+
+    The least recently used pixels are dropped once more than max_size bytes
+    are stored, so a size of zero disables the cache.
+
+    A cache can be shared between readers and threads. The entries are split
+    by key into n_stripes parts, each with its own lock, so threads using
+    different images rarely wait for each other. Use is tracked in each part,
+    so entries are dropped in approximately least recently used order.
+    """
+
+    def __init__(self, max_size: int = 16 * 2**20, n_stripes: int = 16) -> None:
+        assert n_stripes > 0
+        self.max_size = max_size
+        self._stripes = [_Stripe() for _ in range(n_stripes)]
+
+    @property
+    def size(self) -> int:
+        return sum(stripe.size for stripe in self._stripes)
+
+    @property
+    def n_hits(self) -> int:
+        return sum(stripe.n_hits for stripe in self._stripes)
+
+    @property
+    def n_misses(self) -> int:
+        return sum(stripe.n_misses for stripe in self._stripes)
+
+    def __len__(self) -> int:
+        return sum(len(stripe.entries) for stripe in self._stripes)
+
+    def get(self, key: bytes) -> bytes | None:
+        stripe = self._get_stripe(key)
+        with stripe.lock:
+            pixels = stripe.entries.get(key)
+            if pixels is None:
+                stripe.n_misses += 1
+                return None
+            stripe.entries.move_to_end(key)
+            stripe.n_hits += 1
+            return pixels
+
+    def put(self, key: bytes, pixels: bytes) -> None:
+        if len(pixels) > self.max_size:
+            return
+        stripe = self._get_stripe(key)
+        with stripe.lock:
+            old_pixels = stripe.entries.pop(key, None)
+            if old_pixels is not None:
+                stripe.size -= len(old_pixels)
+            stripe.entries[key] = pixels
+            stripe.size += len(pixels)
+
+            # Make space in this part first
+            while self.size > self.max_size and len(stripe.entries) > 1:
+                (_, old_pixels) = stripe.entries.popitem(last=False)
+                stripe.size -= len(old_pixels)
+
+        # Then in the other parts. Only one lock is held at a time so threads
+        # can't deadlock
+        for other in self._stripes:
+            if self.size <= self.max_size:
+                break
+            if other is stripe:
+                continue
+            with other.lock:
+                while self.size > self.max_size and len(other.entries) > 0:
+                    (_, old_pixels) = other.entries.popitem(last=False)
+                    other.size -= len(old_pixels)
+
+    def clear(self) -> None:
+        for stripe in self._stripes:
+            with stripe.lock:
+                stripe.entries.clear()
+                stripe.size = 0
+
+    def _get_stripe(self, key: bytes) -> _Stripe:
+        return self._stripes[hash(key) % len(self._stripes)]
+
+
+class DiskDecodeCache(DecodeCache):
+    """
+    Decode cache stored as files in directory, so it can be shared between
+    processes and kept between runs.
+
+    Each entry is a file of the raw pixels (one byte each), so entries can be
+    memory mapped with get_mmap(). Files are written under a temporary name and renamed into
+    place, so other processes never see a partial entry. Once more than
+    max_size bytes are stored the least recently used files are removed.
+    Entries added by other processes are only counted when the directory is
+    next scanned, so the limit can be briefly exceeded.
+    """
+
+    def __init__(self, directory, max_size: int = 256 * 2**20) -> None:
+        DecodeCache.__init__(self, max_size)
+        self.directory = os.fspath(directory)
+        os.makedirs(self.directory, exist_ok=True)
+
+        # Size of the files, which is read from the directory on first use and
+        # updated when scanning to remove entries
+        self._lock = threading.Lock()
+        self._size = 0
+        self._scanned = False
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def __len__(self) -> int:
+        return len(self._get_entries())
+
+    def get_path(self, key: bytes) -> str:
+        """
+        Get the file the pixels for key are stored in.
+        """
+        name = key.hex()
+        return os.path.join(self.directory, name[:2], name)
+
+    def get(self, key: bytes) -> bytes | None:
+        path = self.get_path(key)
+        try:
+            with open(path, "rb") as f:
+                pixels = f.read()
+            # Mark as recently used
+            os.utime(path)
+        except OSError:
+            pixels = None
+        self._count(key, pixels is not None)
+        return pixels
+
+    def get_mmap(self, key: bytes) -> mmap.mmap | None:
+        """
+        Get the pixels for key as a read-only memory map of its file, so they
+        aren't read into memory. The map stays valid if the entry is removed.
+        Empty entries can't be mapped so are treated as missing.
+        """
+        path = self.get_path(key)
+        try:
+            with open(path, "rb") as f:
+                pixels = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            os.utime(path)
+        except (OSError, ValueError):
+            pixels = None
+        self._count(key, pixels is not None)
+        return pixels
+
+    def put(self, key: bytes, pixels: bytes) -> None:
+        if len(pixels) > self.max_size:
+            return
+        path = self.get_path(key)
+        directory = os.path.dirname(path)
+
+        # Pixels for a key don't change, so if there is already an entry it is
+        # only marked as recently used
+        try:
+            os.utime(path)
+            return
+        except OSError:
+            pass
+
+        # Failing to write is not an error, the pixels are just not cached
+        temporary_path = None
+        try:
+            os.makedirs(directory, exist_ok=True)
+            (fd, temporary_path) = tempfile.mkstemp(
+                dir=directory, prefix=".", suffix=".tmp"
+            )
+            with os.fdopen(fd, "wb") as f:
+                f.write(pixels)
+            os.replace(temporary_path, path)
+        except OSError:
+            if temporary_path is not None:
+                _remove(temporary_path)
+            return
+
+        with self._lock:
+            self._size += len(pixels)
+            if self._scanned and self._size <= self.max_size:
+                return
+            self._evict()
+
+    def clear(self) -> None:
+        with self._lock:
+            for _, _, path in self._get_entries():
+                _remove(path)
+            self._size = 0
+
+    def _count(self, key: bytes, hit: bool) -> None:
+        stripe = self._get_stripe(key)
+        with stripe.lock:
+            if hit:
+                stripe.n_hits += 1
+            else:
+                stripe.n_misses += 1
+
+    def _evict(self) -> None:
+        # Remove the oldest entries until well under the limit, so the
+        # directory isn't scanned again straight away
+        entries = self._get_entries()
+        size = sum(entry_size for _, entry_size, _ in entries)
+        if size > self.max_size:
+            entries.sort()
+            for _, entry_size, path in entries:
+                if size <= self.max_size * 3 // 4:
+                    break
+                _remove(path)
+                size -= entry_size
+        self._size = size
+        self._scanned = True
+
+    def _get_entries(self) -> list[tuple[float, int, str]]:
+        # Get the last use time, size and path of each entry. Files may be
+        # removed by other processes while scanning
+        entries = []
+        now = time.time()
+        try:
+            directories = [e.path for e in os.scandir(self.directory) if e.is_dir()]
+        except OSError:
+            return []
+        for directory in directories:
+            try:
+                files = list(os.scandir(directory))
+            except OSError:
+                continue
+            for file in files:
+                try:
+                    stat = file.stat()
+                except OSError:
+                    continue
+                if file.name.endswith(".tmp"):
+                    if now - stat.st_mtime > _STALE_TEMPORARY_AGE:
+                        _remove(file.path)
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, file.path))
+        return entries
+
+
+def _remove(path: str) -> None:
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
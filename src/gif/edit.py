@@ -0,0 +1,185 @@
+# Copyright 2018 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License version 3, as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranties of MERCHANTABILITY,
+# SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Lesser
+# General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import struct
+from collections.abc import Sequence
+
+from gif.image import (
+    ApplicationExtension,
+    Block,
+    GraphicControlExtension,
+    Image,
+    PlainTextExtension,
+    Trailer,
+    UnknownBlock,
+    Version,
+)
+from gif.palette import Palette
+from gif.reader import Reader
+from gif.writer import Writer
+
+__all__ = ["concatenate", "retime", "trim"]
+
+
+def retime(reader: Reader, file, delay_time: int | Sequence[int]) -> None:
+    """
+    Write the GIF in reader to file with new delay times (in hundredths of a
+    second), either one for all frames or one per frame.
+
+    Like the other editing functions, image data is copied without being
+    decoded.
+    """
+    if isinstance(delay_time, int):
+        delay_times: Sequence[int] = [delay_time] * _count_frames(reader)
+    else:
+        delay_times = delay_time
+    writer = Writer(file)
+    _write_header(writer, [reader], Version.GIF89a)
+    _copy_blocks(writer, reader, delay_times=delay_times)
+    writer.write_trailer()
+
+
+def trim(reader: Reader, file, start: int, end: int | None = None) -> None:
+    """
+    Write frames start to end (inclusive) of the GIF in reader to file.
+
+    Frames are copied as they are, so start should be a keyframe (see
+    FrameIndex) for the first frame to look the same as before.
+    """
+    if end is None:
+        end = _count_frames(reader) - 1
+    writer = Writer(file)
+    _write_header(writer, [reader])
+    _copy_blocks(writer, reader, frames=range(start, end + 1))
+    writer.write_trailer()
+
+
+def concatenate(readers: Sequence[Reader], file) -> None:
+    """
+    Write the frames of each GIF in readers to file, one after the other.
+
+    The screen descriptor, global color table and metadata of the first GIF
+    are used. Images from the other GIFs that use a different global color
+    table are given it as a local color table.
+    """
+    assert len(readers) > 0
+    writer = Writer(file)
+    _write_header(writer, readers)
+    for i, reader in enumerate(readers):
+        if i == 0:
+            _copy_blocks(writer, reader)
+        else:
+            if reader.color_table != readers[0].color_table:
+                color_table = reader.color_table
+            else:
+                color_table = None
+            _copy_blocks(
+                writer, reader, color_table=color_table, include_metadata=False
+            )
+    writer.write_trailer()
+
+
+def _count_frames(reader: Reader) -> int:
+    return sum(1 for block in reader.blocks if isinstance(block, Image))
+
+
+def _write_header(
+    writer: Writer, readers: Sequence[Reader], min_version: bytes = Version.GIF87a
+) -> None:
+    reader = readers[0]
+    version = max([min_version] + [r.version for r in readers])
+    width = max(r.width for r in readers)
+    height = max(r.height for r in readers)
+    writer.write_header(version)
+    header_size = 13 + len(reader.color_table) * 3
+    writer.file.write(struct.pack("<HH", width, height))
+    writer.file.write(reader.buffer[10:header_size])
+
+
+def _copy_blocks(
+    writer: Writer,
+    reader: Reader,
+    frames: range | None = None,
+    delay_times: Sequence[int] | None = None,
+    color_table: Palette | None = None,
+    include_metadata: bool = True,
+) -> None:
+    frame = 0
+    control: GraphicControlExtension | None = None
+    for block in reader.blocks:
+        if isinstance(block, (Trailer, UnknownBlock)):
+            break
+        elif isinstance(block, GraphicControlExtension):
+            control = block
+        elif isinstance(block, Image):
+            if frames is None or frame in frames:
+                if delay_times is not None and frame < len(delay_times):
+                    _write_control(writer, control, delay_times[frame])
+                elif control is not None:
+                    writer.write_raw_block(control)
+                _write_image(writer, block, color_table)
+            control = None
+            frame += 1
+        elif isinstance(block, PlainTextExtension):
+            # A control before plain text applies to it rather than the next
+            # image
+            if control is not None:
+                writer.write_raw_block(control)
+            writer.write_raw_block(block)
+            control = None
+        elif include_metadata or not isinstance(block, ApplicationExtension):
+            writer.write_raw_block(block)
+
+
+def _write_control(
+    writer: Writer, control: GraphicControlExtension | None, delay_time: int
+) -> None:
+    if control is None:
+        writer.write_graphic_control_extension(delay_time=delay_time)
+        return
+
+    # Patch the delay time so the other fields (including reserved bits) are
+    # kept
+    data = bytearray(control.get_data())
+    if len(data) >= 7 and data[2] >= 4:
+        data[4:6] = struct.pack("<H", delay_time)
+        writer.file.write(data)
+    else:
+        writer.write_graphic_control_extension(
+            disposal_method=control.disposal_method,
+            delay_time=delay_time,
+            user_input=control.user_input,
+            has_transparent=control.has_transparent,
+            transparent_color=control.transparent_color,
+        )
+
+
+def _write_image(writer: Writer, image: Image, color_table: Palette | None) -> None:
+    if color_table is None or len(image.color_table) > 0 or len(color_table) == 0:
+        writer.write_raw_block(image)
+        return
+
+    # Add color table to the image descriptor, and copy the LZW data after it
+    depth = len(color_table).bit_length() - 1
+    writer.write_image_descriptor(
+        image.left,
+        image.top,
+        image.width,
+        image.height,
+        has_color_table=True,
+        depth=depth,
+        interlace=image.interlace,
+    )
+    writer.write_color_table(color_table, depth)
+    writer.write_raw_block(Block(image.data, image.offset + 10, image.length - 10))
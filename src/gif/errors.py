@@ -0,0 +1,29 @@
+# Copyright 2018 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License version 3, as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranties of MERCHANTABILITY,
+# SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Lesser
+# General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__all__ = ["LimitExceededError"]
+
+
+class LimitExceededError(ValueError):
+    """
+    Raised when a GIF exceeds a configured resource limit.
+    """
+
+    def __init__(self, limit: str, value: float, maximum: float) -> None:
+        ValueError.__init__(
+            self, "%s of %s exceeds limit of %s" % (limit, value, maximum)
+        )
+        self.limit = limit
+        self.value = value
+        self.maximum = maximum
@@ -0,0 +1,235 @@
+# Copyright 2018 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License version 3, as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranties of MERCHANTABILITY,
+# SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Lesser
+# General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import struct
+
+from gif.image import DisposalMethod, Image
+from gif.reader import Reader
+from gif.renderer import AnimationRenderer, Frame, Renderer, get_frames
+
+__all__ = ["FrameIndex", "FrameIndexEntry"]
+
+_MAGIC = b"GIFINDEX"
+_HEADER_FORMAT = "<8sBHHII"
+_ENTRY_FORMAT = "<IHBhI"
+_VERSION = 1
+
+
+class FrameIndexEntry:
+    def __init__(
+        self,
+        offset: int,
+        delay_time: int,
+        disposal_method: int,
+        transparent_color: int | None,
+        keyframe: int,
+    ) -> None:
+        self.offset = offset
+        self.delay_time = delay_time
+        self.disposal_method = disposal_method
+        self.transparent_color = transparent_color
+        self.keyframe = keyframe
+
+
+class FrameIndex:
+    """
+    Frame offsets and timing of an animation, with the nearest keyframe each
+    frame can be rendered from.
+
+    A keyframe is a frame whose rendered output does not depend on any earlier
+    frame, i.e. the first frame, an opaque frame covering the whole canvas, or
+    a frame drawn after the whole canvas was restored to the background.
+    Keyframes are found from the block structure alone. When rendering, a
+    keyframe whose image data is truncated doesn't cover the canvas, so the
+    keyframe before it is used instead.
+    """
+
+    def __init__(
+        self, width: int, height: int, data_length: int, entries: list[FrameIndexEntry]
+    ) -> None:
+        self.width = width
+        self.height = height
+        self.data_length = data_length
+        self.entries = entries
+
+    @classmethod
+    def from_reader(cls, reader: Reader) -> "FrameIndex":
+        entries = []
+        keyframe = 0
+        last_frame: Frame | None = None
+        for i, frame in enumerate(get_frames(reader.blocks)):
+            if (
+                last_frame is None
+                or (
+                    last_frame.disposal_method == DisposalMethod.RESTORE_BACKGROUND
+                    and _covers_canvas(last_frame.image, reader.width, reader.height)
+                )
+                or (
+                    frame.transparent_color is None
+                    and frame.disposal_method != DisposalMethod.RESTORE_PREVIOUS
+                    and _covers_canvas(frame.image, reader.width, reader.height)
+                )
+            ):
+                keyframe = i
+            entries.append(
+                FrameIndexEntry(
+                    frame.image.offset,
+                    frame.delay_time,
+                    frame.disposal_method,
+                    frame.transparent_color,
+                    keyframe,
+                )
+            )
+            last_frame = frame
+        return cls(reader.width, reader.height, len(reader.buffer), entries)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "FrameIndex":
+        header_size = struct.calcsize(_HEADER_FORMAT)
+        entry_size = struct.calcsize(_ENTRY_FORMAT)
+        if len(data) < header_size:
+            raise ValueError("Insufficient data for frame index header")
+        (magic, version, width, height, data_length, n_entries) = struct.unpack(
+            _HEADER_FORMAT, data[:header_size]
+        )
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError("Not a frame index")
+        if len(data) < header_size + n_entries * entry_size:
+            raise ValueError("Insufficient data for frame index entries")
+        entries = []
+        for (
+            offset,
+            delay_time,
+            disposal_method,
+            transparent_color,
+            keyframe,
+        ) in struct.iter_unpack(
+            _ENTRY_FORMAT, data[header_size : header_size + n_entries * entry_size]
+        ):
+            if transparent_color < 0:
+                transparent_color = None
+            entries.append(
+                FrameIndexEntry(
+                    offset, delay_time, disposal_method, transparent_color, keyframe
+                )
+            )
+        return cls(width, height, data_length, entries)
+
+    def to_bytes(self) -> bytes:
+        data = [
+            struct.pack(
+                _HEADER_FORMAT,
+                _MAGIC,
+                _VERSION,
+                self.width,
+                self.height,
+                self.data_length,
+                len(self.entries),
+            )
+        ]
+        for entry in self.entries:
+            if entry.transparent_color is None:
+                transparent_color = -1
+            else:
+                transparent_color = entry.transparent_color
+            data.append(
+                struct.pack(
+                    _ENTRY_FORMAT,
+                    entry.offset,
+                    entry.delay_time,
+                    entry.disposal_method,
+                    transparent_color,
+                    entry.keyframe,
+                )
+            )
+        return b"".join(data)
+
+    def save(self, file) -> None:
+        file.write(self.to_bytes())
+
+    def get_frames(self, reader: Reader, start: int, end: int) -> list[Frame]:
+        """
+        Get frames start to end (inclusive) using the images parsed by reader.
+        """
+        if len(reader.buffer) != self.data_length:
+            raise ValueError("Frame index does not match GIF data")
+        images = {}
+        for block in reader.blocks:
+            if isinstance(block, Image):
+                images[block.offset] = block
+        frames = []
+        for entry in self.entries[start : end + 1]:
+            image = images.get(entry.offset)
+            if image is None:
+                raise ValueError("No image at offset %d" % entry.offset)
+            frames.append(
+                Frame(
+                    image,
+                    entry.delay_time,
+                    entry.disposal_method,
+                    entry.transparent_color,
+                )
+            )
+        return frames
+
+    def seek(self, reader: Reader, frame: int) -> bytes:
+        """
+        Render frame, decoding only the images from the nearest keyframe on.
+        Returns the canvas as RGBA pixels.
+        """
+        keyframe = self.entries[frame].keyframe
+        frames = self.get_frames(reader, keyframe, frame)
+        pixels = frames[0].image.get_pixels()
+        # A keyframe whose image data is truncated doesn't cover the canvas, so
+        # use the keyframe before it
+        image = frames[0].image
+        while keyframe > 0 and len(pixels) < image.width * image.height:
+            keyframe = self.entries[keyframe - 1].keyframe
+            frames = self.get_frames(reader, keyframe, frame)
+            image = frames[0].image
+            pixels = image.get_pixels()
+        renderer = Renderer(reader.width, reader.height, reader.color_table)
+        renderer.render(frames[0], pixels)
+        for f in frames[1:]:
+            renderer.render(f)
+        return renderer.get_pixels()
+
+    def get_renderer(
+        self,
+        reader: Reader,
+        checkpoint_interval: int = 0,
+        checkpoint_memory_limit: int = 64 * 1024 * 1024,
+    ) -> AnimationRenderer:
+        """
+        Get a renderer for repeated seeking that starts from keyframes and
+        optionally stores checkpoints (see AnimationRenderer).
+        """
+        return AnimationRenderer(
+            reader.width,
+            reader.height,
+            reader.color_table,
+            self.get_frames(reader, 0, len(self.entries) - 1),
+            keyframes=[entry.keyframe for entry in self.entries],
+            checkpoint_interval=checkpoint_interval,
+            checkpoint_memory_limit=checkpoint_memory_limit,
+        )
+
+
+def _covers_canvas(image: Image, width: int, height: int) -> bool:
+    return (
+        image.left == 0
+        and image.top == 0
+        and image.width >= width
+        and image.height >= height
+    )
@@ -12,9 +12,18 @@
 # You should have received a copy of the GNU Lesser General Public License along
 # with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import hashlib
+import itertools
 import struct
+from collections.abc import Sequence
 
-from gif.lzw import LZWDecoder
+from gif.cache import DecodeCache
+from gif.errors import LimitExceededError
+from gif.lzw import LZWDecoder, LZWStats
+from gif.palette import Palette
+
+# Largest output buffer kept by pooled decoders
+_MAX_POOLED_VALUES = 4 * 1024 * 1024
 
 
 class Version:
@@ -43,29 +52,33 @@ class BlockType:
 
 
 class Block:
-    def __init__(self, data: bytes, offset: int, length: int) -> None:
+    def __init__(self, data: bytes | bytearray, offset: int, length: int) -> None:
         self.data = data
         self.offset = offset
         self.length = length
 
     def get_data(self) -> bytes:
-        return self.data[self.offset : self.offset + self.length]
+        return bytes(self.data[self.offset : self.offset + self.length])
 
 
 class Image(Block):
     def __init__(
         self,
-        data: bytes,
+        data: bytes | bytearray,
         offset: int,
         length: int,
         left: int,
         top: int,
         width: int,
         height: int,
-        color_table: list[tuple[int, int, int]],
+        color_table: Palette,
         color_table_sorted: bool,
         interlace: bool,
         lzw_min_code_size: int,
+        max_pixels: int | None = None,
+        max_compression_ratio: float | None = None,
+        decoder_pool: list[LZWDecoder] | None = None,
+        decode_cache: DecodeCache | None = None,
     ) -> None:
         Block.__init__(self, data, offset, length)
         self.left = left
@@ -76,32 +89,136 @@ class Image(Block):
         self.color_table_sorted = color_table_sorted
         self.interlace = interlace
         self.lzw_min_code_size = lzw_min_code_size
-
-    def get_lzw_data(self):
-        offset = self.offset + 10 + len(self.color_table) * 3 + 1
-        (subblock_offsets, _) = _get_subblocks(self.data, offset)
-        data = b""
-        for offset, length in subblock_offsets:
-            data += self.data[offset : offset + length]
-        return data
-
-    def decode_lzw(self) -> LZWDecoder:
-        offset = self.offset + 10 + len(self.color_table) * 3 + 1
-        (subblock_offsets, _) = _get_subblocks(self.data, offset)
+        self.max_pixels = max_pixels
+        self.max_compression_ratio = max_compression_ratio
+        self.decoder_pool = decoder_pool
+        self.decode_cache = decode_cache
+        self._lzw_payload: bytes | None = None
+        self._lzw_hash: bytes | None = None
+        self._stats: LZWStats | None = None
+
+    def get_lzw_hash(self) -> bytes:
+        """
+        Get a hash of the values that affect the decoded pixels: the LZW
+        minimum code size, image size, interlacing and LZW data. Images with
+        the same hash decode to the same pixels, so this is the key used for
+        the decode cache.
+        """
+        if self._lzw_hash is None:
+            h = hashlib.blake2b(digest_size=16)
+            h.update(
+                struct.pack(
+                    "<BHHB",
+                    self.lzw_min_code_size,
+                    self.width,
+                    self.height,
+                    self.interlace,
+                )
+            )
+            h.update(self._get_lzw_payload())
+            self._lzw_hash = h.digest()
+        return self._lzw_hash
+
+    def get_lzw_data(self) -> bytes:
+        return self._get_lzw_payload()
+
+    def _get_lzw_payload(self) -> bytes:
+        if self._lzw_payload is None:
+            offset = self.offset + 10 + len(self.color_table) * 3 + 1
+            self._lzw_payload = _join_subblocks(self.data, offset)
+        return self._lzw_payload
+
+    def decode_lzw(self, expected_values: int | None = None) -> LZWDecoder:
         if self.lzw_min_code_size >= 12:
             print("Image has invalid code size of %d" % self.lzw_min_code_size)
             return LZWDecoder()
-        decoder = LZWDecoder(self.lzw_min_code_size)
-        for offset, length in subblock_offsets:
-            decoder.feed(self.data, offset, length)
+        decoder = LZWDecoder(
+            self.lzw_min_code_size,
+            max_values=self.max_pixels,
+            max_ratio=self.max_compression_ratio,
+            expected_values=expected_values,
+        )
+        decoder.feed(self._get_lzw_payload())
         return decoder
 
-    def get_pixels(self) -> list[int]:
-        return self.decode_lzw().values
+    def get_pixels(self) -> Sequence[int]:
+        """
+        Get the color index of each pixel. For code sizes up to 8 (all valid
+        GIFs) these are a bytearray, or bytes shared with the decode cache -
+        before version 0.6 they were a list.
+        """
+        # Identical images share one decode
+        if self.decode_cache is None or self.lzw_min_code_size > 8:
+            return self._decode_pixels()
+        key = self.get_lzw_hash()
+        pixels = self.decode_cache.get(key)
+        if pixels is None:
+            pixels = bytes(self._decode_pixels())
+            self.decode_cache.put(key, pixels)
+        else:
+            # The cached pixels may have been decoded without this image's limits
+            self._check_limits(len(pixels))
+        return pixels
+
+    def get_stats(self) -> LZWStats:
+        """
+        Get statistics about the LZW data. These are recorded when the image
+        is decoded, so the image is decoded if it hasn't been yet.
+        """
+        if self._stats is None:
+            self._decode_pixels()
+        assert self._stats is not None
+        return self._stats
+
+    def _check_limits(self, n_values: int) -> None:
+        # Same checks as the decoder, for the whole of the data
+        if self.max_pixels is not None and n_values > self.max_pixels:
+            raise LimitExceededError("Decoded values", n_values, self.max_pixels)
+        n_bytes = len(self._get_lzw_payload())
+        if (
+            self.max_compression_ratio is not None
+            and n_values > self.max_compression_ratio * n_bytes
+        ):
+            raise LimitExceededError(
+                "Compression ratio",
+                round(n_values / max(n_bytes, 1), 1),
+                self.max_compression_ratio,
+            )
+
+    def _decode_pixels(self) -> Sequence[int]:
+        # Pixels beyond the image size are not decoded
+        n_pixels = self.width * self.height
+        if self.decoder_pool is None or self.lzw_min_code_size >= 12:
+            decoder = self.decode_lzw(n_pixels)
+            self._stats = decoder.get_stats()
+            return decoder.values
+
+        # Use a decoder from the pool, so its tables don't have to be allocated
+        # again. Decoders are removed while in use so the pool can be shared
+        # between threads
+        try:
+            decoder = self.decoder_pool.pop()
+        except IndexError:
+            decoder = LZWDecoder(
+                self.lzw_min_code_size,
+                max_values=self.max_pixels,
+                max_ratio=self.max_compression_ratio,
+            )
+        try:
+            decoder.reset(self.lzw_min_code_size, n_pixels)
+            decoder.feed(self._get_lzw_payload())
+            self._stats = decoder.get_stats()
+            return decoder.values
+        finally:
+            # Don't keep the output buffer of a large image in the pool
+            del decoder.buffer[_MAX_POOLED_VALUES:]
+            self.decoder_pool.append(decoder)
 
 
 class Extension(Block):
-    def __init__(self, data: bytes, offset: int, length: int, label: int) -> None:
+    def __init__(
+        self, data: bytes | bytearray, offset: int, length: int, label: int
+    ) -> None:
         Block.__init__(self, data, offset, length)
         self.label = label
 
@@ -111,14 +228,14 @@ class Extension(Block):
             return []
         subblocks = []
         for offset, length in subblock_offsets:
-            subblocks.append(self.data[offset : offset + length])
+            subblocks.append(bytes(self.data[offset : offset + length]))
         return subblocks
 
 
 class PlainTextExtension(Extension):
     def __init__(
         self,
-        data: bytes,
+        data: bytes | bytearray,
         offset: int,
         length: int,
         left: int,
@@ -150,7 +267,7 @@ class PlainTextExtension(Extension):
 class GraphicControlExtension(Extension):
     def __init__(
         self,
-        data: bytes,
+        data: bytes | bytearray,
         offset: int,
         length: int,
         disposal_method,
@@ -168,7 +285,7 @@ class GraphicControlExtension(Extension):
 
 
 class CommentExtension(Extension):
-    def __init__(self, data: bytes, offset: int, length: int) -> None:
+    def __init__(self, data: bytes | bytearray, offset: int, length: int) -> None:
         Extension.__init__(self, data, offset, length, ExtensionLabel.COMMENT)
 
     def get_comment(self, encoding: str = "utf-8") -> str:
@@ -181,7 +298,7 @@ class CommentExtension(Extension):
 class ApplicationExtension(Extension):
     def __init__(
         self,
-        data: bytes,
+        data: bytes | bytearray,
         offset: int,
         length: int,
         identifier: str,
@@ -219,7 +336,7 @@ def _decode_animation_subblocks(
 
 
 class NetscapeExtension(ApplicationExtension):
-    def __init__(self, data: bytes, offset: int, length: int) -> None:
+    def __init__(self, data: bytes | bytearray, offset: int, length: int) -> None:
         ApplicationExtension.__init__(self, data, offset, length, "NETSCAPE", "2.0")
         (self.loop_count, self.buffer_size, self.unused_subblocks) = (
             _decode_animation_subblocks(self)
@@ -227,7 +344,7 @@ class NetscapeExtension(ApplicationExtension):
 
 
 class AnimationExtension(ApplicationExtension):
-    def __init__(self, data: bytes, offset: int, length: int) -> None:
+    def __init__(self, data: bytes | bytearray, offset: int, length: int) -> None:
         ApplicationExtension.__init__(self, data, offset, length, "ANIMEXTS", "1.0")
         (self.loop_count, self.buffer_size, self.unused_subblocks) = (
             _decode_animation_subblocks(self)
@@ -235,7 +352,7 @@ class AnimationExtension(ApplicationExtension):
 
 
 class XMPDataExtension(ApplicationExtension):
-    def __init__(self, data: bytes, offset: int, length: int) -> None:
+    def __init__(self, data: bytes | bytearray, offset: int, length: int) -> None:
         ApplicationExtension.__init__(self, data, offset, length, "XMP Data", "XMP")
 
     def get_metadata(self, encoding="utf-8"):
@@ -248,7 +365,7 @@ class XMPDataExtension(ApplicationExtension):
 
 
 class ICCColorProfileExtension(ApplicationExtension):
-    def __init__(self, data: bytes, offset: int, length: int) -> None:
+    def __init__(self, data: bytes | bytearray, offset: int, length: int) -> None:
         ApplicationExtension.__init__(self, data, offset, length, "ICCRGBG1", "012")
 
     def get_icc_profile(self):
@@ -259,28 +376,62 @@ class ICCColorProfileExtension(ApplicationExtension):
 
 
 class Trailer(Block):
-    def __init__(self, data: bytes, offset: int, length: int) -> None:
+    def __init__(self, data: bytes | bytearray, offset: int, length: int) -> None:
         Block.__init__(self, data, offset, length)
 
 
 class UnknownBlock(Block):
-    def __init__(self, data: bytes, offset: int, block_type: int) -> None:
+    def __init__(self, data: bytes | bytearray, offset: int, block_type: int) -> None:
         Block.__init__(self, data, offset, 0)
         self.block_type = block_type
 
 
-def _get_subblocks(data, offset: int) -> tuple[list[tuple[int, int]], int]:
-    n_required = 0
+def _get_subblocks(
+    data,
+    offset: int,
+    subblocks: list[tuple[int, int]] | None = None,
+    n_complete: int = 0,
+) -> tuple[list[tuple[int, int]] | None, int]:
+    # Returns (None, n_complete) if the data doesn't contain all the subblocks
+    # yet, where the first n_complete bytes are subblocks already added to
+    # subblocks. Passing these back in continues from there
+    if subblocks is None:
+        subblocks = []
     n_available = len(data) - offset
-    subblocks: list[tuple[int, int]] = []
     while True:
-        if n_available < n_required + 1:
-            raise ValueError("Insufficient data for subblock size")
-        subblock_size = data[offset + n_required]
-        n_required += 1
+        if n_available < n_complete + 1:
+            return (None, n_complete)
+        subblock_size = data[offset + n_complete]
+        if subblock_size == 0:
+            return (subblocks, n_complete + 1)
+        if n_available < n_complete + 1 + subblock_size:
+            return (None, n_complete)
+        subblocks.append((offset + n_complete + 1, subblock_size))
+        n_complete += 1 + subblock_size
+
+
+def _get_row_order(top: int, height: int, interlace: bool):
+    # Interlaced images are stored in four passes: every 8th row, then the rows
+    # four below those, then every 4th row left over and finally the odd rows
+    bottom = top + height
+    if not interlace:
+        return range(top, bottom)
+    return itertools.chain(
+        range(top, bottom, 8),
+        range(top + 4, bottom, 8),
+        range(top + 2, bottom, 4),
+        range(top + 1, bottom, 2),
+    )
+
+
+def _join_subblocks(data, offset: int) -> bytes:
+    # Always copied, as the reader's buffer can't grow while views of it exist
+    subblocks = []
+    while offset < len(data):
+        subblock_size = data[offset]
+        offset += 1
         if subblock_size == 0:
-            return (subblocks, n_required)
-        subblocks.append((offset + n_required, subblock_size))
-        n_required += subblock_size
-        if n_available < n_required:
-            raise ValueError("Insufficient data for subblock")
+            break
+        subblocks.append(data[offset : offset + subblock_size])
+        offset += subblock_size
+    return b"".join(subblocks)
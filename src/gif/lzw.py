@@ -12,12 +12,102 @@
 # You should have received a copy of the GNU Lesser General Public License along
 # with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import array
 import struct
+import sys
+from collections.abc import Iterable, MutableSequence, Sized
+
+from gif.errors import LimitExceededError
+
+__all__ = ["LZWEncoder", "LZWDecoder", "LZWStats"]
+
+_SINGLE_VALUES = [bytes((i,)) for i in range(256)]
+
+# Number of codes packed at once in store mode, and masks selecting alternate
+# 16, 32 and 64 bit lanes of a block of that many 16 bit codes
+_STORE_BLOCK_SIZE = 4096
+_STORE_LANE_MASKS = [
+    (
+        int.from_bytes(
+            (b"\xff" * n + b"\x00" * n) * (_STORE_BLOCK_SIZE // n), "little"
+        ),
+        int.from_bytes(
+            (b"\x00" * n + b"\xff" * n) * (_STORE_BLOCK_SIZE // n), "little"
+        ),
+    )
+    for n in (2, 4, 8)
+]
+
+
+class LZWStats:
+    """
+    Statistics about an LZW stream: the number of codes of each width, the
+    number of clear codes and of times the code table filled up, the number
+    of values and bytes, and the number of bytes after the end of
+    information code.
+    """
 
-__all__ = ["LZWEncoder", "LZWDecoder"]
+    def __init__(
+        self,
+        min_code_size: int,
+        codes_per_width: dict[int, int],
+        n_clears: int,
+        n_table_fills: int,
+        n_values: int,
+        n_bytes: int,
+        n_trailing_bytes: int,
+    ) -> None:
+        self.min_code_size = min_code_size
+        self.codes_per_width = codes_per_width
+        self.n_clears = n_clears
+        self.n_table_fills = n_table_fills
+        self.n_values = n_values
+        self.n_bytes = n_bytes
+        self.n_trailing_bytes = n_trailing_bytes
+
+    @property
+    def n_codes(self) -> int:
+        return sum(self.codes_per_width.values())
+
+    @property
+    def bits_per_value(self) -> float:
+        if self.n_values == 0:
+            return 0.0
+        return self.n_bytes * 8 / self.n_values
+
+    @property
+    def compression_ratio(self) -> float:
+        if self.n_bytes == 0:
+            return 0.0
+        return self.n_values / self.n_bytes
+
+    def __repr__(self) -> str:
+        return (
+            "LZWStats(codes_per_width=%r, n_clears=%d, n_table_fills=%d, "
+            "n_values=%d, n_bytes=%d, n_trailing_bytes=%d)"
+            % (
+                self.codes_per_width,
+                self.n_clears,
+                self.n_table_fills,
+                self.n_values,
+                self.n_bytes,
+                self.n_trailing_bytes,
+            )
+        )
 
 
 class LZWEncoder:
+    """
+    LZW encoder for GIF image data, writing sub-blocks to file.
+
+    An encoder can be reused for another image by calling reset(), which keeps
+    the code table and output buffer allocated.
+
+    In store mode no compression is done: only literal codes are written, with
+    a clear code before the code size would grow. This is much faster, but the
+    output is larger than the uncompressed values.
+    """
+
     def __init__(
         self,
         file,
@@ -25,128 +115,416 @@ class LZWEncoder:
         max_code_size: int = 12,
         start_with_clear: bool = True,
         clear_on_max_width: bool = True,
+        store: bool = False,
     ) -> None:
         self.file = file
-        self.min_code_size = max(min_code_size, 2)
         self.max_code_size = max_code_size
         self.clear_on_max_width = clear_on_max_width
+        self.store = store
+
+        # Data being output, with bits not yet making a full octet
+        self.data = bytearray()
+        self.bits = 0
+        self.n_bits = 0
+
+        # Codes added to the table, keyed by (prefix code << 12 | value). Codes
+        # for single values are the values themselves so are not stored
+        self.code_table: dict[int, int] = {}
 
+        # Codes not yet packed in store mode, and the number of literals
+        # written since the last clear
+        self.store_codes = array.array("H")
+        self.n_literals = 0
+
+        self.reset(min_code_size, start_with_clear)
+
+    def reset(self, min_code_size: int, start_with_clear: bool = True) -> None:
+        """
+        Start encoding a new image.
+        """
+        self.min_code_size = max(min_code_size, 2)
         assert self.min_code_size < self.max_code_size
 
-        # Data being output
-        self.data = b""
-        self.octet = 0x00
-        self.octet_bits = 0
+        self.data.clear()
+        self.bits = 0
+        self.n_bits = 0
 
         # Code table
         self.clear_code = 2**self.min_code_size
         self.eoi_code = self.clear_code + 1
-        self.code_table = {}
-        for i in range(2**self.min_code_size):
-            self.code_table[(i,)] = i
+        self.code_table.clear()
         self.next_code = self.eoi_code + 1
 
-        # Code currently being encoded
-        self.code: tuple = tuple()
+        # Code currently being encoded (-1 if none)
+        self.code = -1
         self.code_size = self.min_code_size + 1
 
+        del self.store_codes[:]
+        self.n_literals = 0
+
+        # Statistics
+        self.codes_per_width = [0] * (self.max_code_size + 1)
+        self.n_clears = 0
+        self.n_table_fills = 0
+        self.n_values = 0
+        self.n_trailing_bytes = 0
+
         self.file.write(struct.pack("B", self.min_code_size))
 
         if start_with_clear:
-            self._write_code(self.clear_code)
-
-    def feed(self, values: list[int]) -> None:
+            self.clear()
+
+    def feed(self, values: Iterable[int]) -> None:
+        if not isinstance(values, Sized):
+            values = list(values)
+        self.n_values += len(values)
+        if self.store:
+            self._store(values)
+            return
+
+        # State is kept in local variables while encoding as this is much faster
+        # than using attributes
+        code_table = self.code_table
+        data = self.data
+        file = self.file
+        clear_code = self.clear_code
+        max_codes = 2**self.max_code_size
+        clear_on_max_width = self.clear_on_max_width
+        bits = self.bits
+        n_bits = self.n_bits
+        code = self.code
+        code_size = self.code_size
+        next_code = self.next_code
+
+        # Codes are counted for each width when the width changes
+        codes_per_width = self.codes_per_width
+        n_codes = 0
+        width_start = 0
         for value in values:
-            self.code += (value,)
-
-            if self.code in self.code_table:
+            if code < 0:
+                code = value
+                continue
+            key = code << 12 | value
+            existing_code = code_table.get(key)
+            if existing_code is not None:
+                code = existing_code
                 continue
 
             # If there are available bits, then add a new code
-            if self.next_code < 2**self.max_code_size:
-                new_code = self.next_code
-                self.next_code += 1
-                self.code_table[self.code] = new_code
-
-            self._write_code(self.code_table[self.code[:-1]])
-            self.code = self.code[-1:]
+            if next_code < max_codes:
+                code_table[key] = next_code
+                next_code += 1
+                if next_code == max_codes:
+                    self.n_table_fills += 1
+
+            # Write the code for the values before this one
+            bits |= code << n_bits
+            n_bits += code_size
+            n_codes += 1
+            while n_bits >= 8:
+                data.append(bits & 0xFF)
+                bits >>= 8
+                n_bits -= 8
+                if len(data) == 255:
+                    file.write(b"\xff")
+                    file.write(data)
+                    data.clear()
+            code = value
 
             # Use enough bits to place the next code
-            if self.next_code == 2**self.code_size + 1:
-                self.code_size += 1
+            if next_code == (1 << code_size) + 1:
+                codes_per_width[code_size] += n_codes - width_start
+                width_start = n_codes
+                code_size += 1
 
             # Clear when out of codes
-            if self.next_code == 2**self.max_code_size and self.clear_on_max_width:
-                self.clear()
+            if next_code == max_codes and clear_on_max_width:
+                bits |= clear_code << n_bits
+                n_bits += code_size
+                n_codes += 1
+                codes_per_width[code_size] += n_codes - width_start
+                width_start = n_codes
+                self.n_clears += 1
+                while n_bits >= 8:
+                    data.append(bits & 0xFF)
+                    bits >>= 8
+                    n_bits -= 8
+                    if len(data) == 255:
+                        file.write(b"\xff")
+                        file.write(data)
+                        data.clear()
+                code_table.clear()
+                code_size = self.min_code_size + 1
+                next_code = self.eoi_code + 1
+        codes_per_width[code_size] += n_codes - width_start
+        self.bits = bits
+        self.n_bits = n_bits
+        self.code = code
+        self.code_size = code_size
+        self.next_code = next_code
 
     def clear(self) -> None:
+        self.n_clears += 1
+        if self.store:
+            self.codes_per_width[self.code_size] += 1
+            self.store_codes.append(self.clear_code)
+            self.n_literals = 0
+            return
         self._write_code(self.clear_code)
-        self.code_table = {}
-        for i in range(2**self.min_code_size):
-            self.code_table[(i,)] = i
+        self.code_table.clear()
         self.code_size = self.min_code_size + 1
         self.next_code = self.eoi_code + 1
 
     def finish(self, send_eoi: bool = True, extra_data: bytes | None = None) -> None:
-        # Write last code in progress
-        self._write_code(self.code_table[self.code])
-        if send_eoi:
-            self._write_code(self.eoi_code)
-        if self.octet_bits > 0:
-            self.data += struct.pack("B", self.octet)
+        if self.store:
+            if send_eoi:
+                self.codes_per_width[self.code_size] += 1
+                self.store_codes.append(self.eoi_code)
+            self._pack_store_codes(True)
+        else:
+            # Write last code in progress
+            if self.code >= 0:
+                self._write_code(self.code)
+            if send_eoi:
+                self._write_code(self.eoi_code)
+            if self.n_bits > 0:
+                self.data.append(self.bits & 0xFF)
 
         if extra_data is not None:
             self.data += extra_data
+            self.n_trailing_bytes += len(extra_data)
 
         # Write remaining blocks
-        while len(self.data) > 0:
-            length = min(len(self.data), 255)
-            self.file.write(struct.pack("B", length))
-            self.file.write(self.data[:length])
-            self.data = self.data[length:]
+        for offset in range(0, len(self.data), 255):
+            block = self.data[offset : offset + 255]
+            self.file.write(struct.pack("B", len(block)))
+            self.file.write(block)
         self.file.write(b"\x00")
 
-        self.data = b""
-        self.code = tuple()
+        self.data.clear()
+        self.bits = 0
+        self.n_bits = 0
+        self.code = -1
+
+    def _store(self, values: Iterable[int]) -> None:
+        if isinstance(values, (bytes, bytearray, memoryview)):
+            # Widen to 16 bit values
+            wide_values = bytearray(len(values) * 2)
+            wide_values[0::2] = values
+            literals = array.array("H", wide_values)
+            if sys.byteorder == "big":
+                literals.byteswap()
+        else:
+            literals = array.array("H", values)
+
+        # Literals up to the point the code size would grow
+        codes = self.store_codes
+        max_literals = 2**self.min_code_size - 2
+        n_first = min(max_literals - self.n_literals, len(literals))
+        codes.extend(literals[:n_first])
+        self.n_literals += n_first
+
+        # Then runs of a clear followed by as many literals as possible
+        n_runs = (len(literals) - n_first) // max_literals
+        if n_runs > 0:
+            run_length = max_literals + 1
+            runs = array.array("H", bytes(n_runs * run_length * 2))
+            runs[0::run_length] = array.array("H", [self.clear_code]) * n_runs
+            end = n_first + n_runs * max_literals
+            for i in range(max_literals):
+                runs[i + 1 :: run_length] = literals[n_first + i : end : max_literals]
+            codes.extend(runs)
+            self.n_literals = max_literals
+        remainder = literals[n_first + n_runs * max_literals :]
+        if len(remainder) > 0:
+            codes.append(self.clear_code)
+            codes.extend(remainder)
+            self.n_literals = len(remainder)
+        n_clears = n_runs + (1 if len(remainder) > 0 else 0)
+        self.n_clears += n_clears
+        self.codes_per_width[self.code_size] += len(literals) + n_clears
+
+        self._pack_store_codes(False)
+
+    def _pack_store_codes(self, finish: bool) -> None:
+        # Codes are packed eight at a time, which makes a whole number of bytes.
+        # The remaining codes are kept for later unless finishing, in which
+        # case they are padded with zero bits
+        codes = self.store_codes
+        n_codes = len(codes)
+        if finish:
+            n_bytes = (n_codes * self.code_size + 7) // 8
+            codes.extend([0] * (-n_codes % 8))
+            n_codes = len(codes)
+        else:
+            n_codes -= n_codes % 8
+            n_bytes = n_codes * self.code_size // 8
+        if n_codes == 0:
+            return
+        start = len(self.data)
+        for offset in range(0, n_codes, _STORE_BLOCK_SIZE):
+            self.data += _pack_codes(
+                codes[offset : min(offset + _STORE_BLOCK_SIZE, n_codes)],
+                self.code_size,
+            )
+        del self.data[start + n_bytes :]
+        del codes[:n_codes]
+
+        # Write full blocks
+        n_blocks = len(self.data) // 255
+        for i in range(n_blocks):
+            self.file.write(b"\xff")
+            self.file.write(self.data[i * 255 : (i + 1) * 255])
+        del self.data[: n_blocks * 255]
+
+    def get_stats(self) -> LZWStats:
+        """
+        Get statistics about the codes written since the last reset.
+        """
+        codes_per_width = {
+            width: n_codes
+            for width, n_codes in enumerate(self.codes_per_width)
+            if n_codes > 0
+        }
+        n_bits = sum(width * n_codes for width, n_codes in codes_per_width.items())
+        return LZWStats(
+            self.min_code_size,
+            codes_per_width,
+            self.n_clears,
+            self.n_table_fills,
+            self.n_values,
+            (n_bits + 7) // 8,
+            self.n_trailing_bytes,
+        )
 
     def _write_code(self, code: int) -> None:
-        bits_needed = self.code_size
-        while bits_needed > 0:
-            bits_used = min(bits_needed, 8 - self.octet_bits)
-            self.octet |= (code << self.octet_bits) & 0xFF
-            self.octet_bits += bits_used
-            code >>= bits_used
-            bits_needed -= bits_used
-            if self.octet_bits == 8:
-                self.data += struct.pack("B", self.octet)
-                if len(self.data) == 255:
-                    self.file.write(b"\xff")
-                    self.file.write(self.data)
-                    self.data = b""
-                self.octet = 0x00
-                self.octet_bits = 0
+        self.codes_per_width[self.code_size] += 1
+        self.bits |= code << self.n_bits
+        self.n_bits += self.code_size
+        while self.n_bits >= 8:
+            self.data.append(self.bits & 0xFF)
+            self.bits >>= 8
+            self.n_bits -= 8
+            if len(self.data) == 255:
+                self.file.write(b"\xff")
+                self.file.write(self.data)
+                self.data.clear()
+
+
+def _pack_codes(codes: array.array, code_size: int) -> bytearray:
+    # Load the codes as one integer with 16 bits per code, then move pairs of
+    # codes together, then pairs of pairs and so on until each group of eight
+    # codes is a whole number of bytes at the start of a 128 bit lane
+    if sys.byteorder == "big":
+        codes = array.array("H", codes)
+        codes.byteswap()
+    value = int.from_bytes(codes.tobytes(), "little")
+    for (even_mask, odd_mask), shift in zip(
+        _STORE_LANE_MASKS, (16 - code_size, 32 - code_size * 2, 64 - code_size * 4)
+    ):
+        value = (value & even_mask) | ((value & odd_mask) >> shift)
+    n_groups = len(codes) // 8
+    lanes = value.to_bytes(n_groups * 16, "little")
+    data = bytearray(n_groups * code_size)
+    for i in range(code_size):
+        data[i::code_size] = lanes[i::16]
+    return data
 
 
 class LZWDecoder:
-    def __init__(self, min_code_size: int = 2, max_code_size: int = 12) -> None:
-        assert min_code_size < max_code_size
+    """
+    LZW decoder for GIF image data.
 
-        self.min_code_size = min_code_size
+    Only counts of the codes read are kept, unless keep_codes is set in which
+    case every code is stored in codes for analysis.
+
+    If expected_values is set, the decoded values are written into a buffer of
+    that size and decoding stops once it is full. The buffer is only grown as
+    far as the data fed so far could decode to within the limits below, so a
+    short stream claiming a large image doesn't allocate much memory. Any codes after that are only
+    counted, and reported in n_excess_codes and n_excess_bytes.
+
+    To protect against decompression bombs, a LimitExceededError is raised
+    before more than max_values values are output, or if the output grows to
+    more than max_ratio times the number of bytes fed.
+
+    A decoder must only be used by one thread at a time.
+    """
+
+    def __init__(
+        self,
+        min_code_size: int = 2,
+        max_code_size: int = 12,
+        max_values: int | None = None,
+        max_ratio: float | None = None,
+        expected_values: int | None = None,
+        keep_codes: bool = False,
+    ) -> None:
         self.max_code_size = max_code_size
+        self.max_values = max_values
+        self.max_ratio = max_ratio
+        self.keep_codes = keep_codes
+
+        # Code table, allocated at the maximum size so it can be reused. Only
+        # the first table_size entries are valid
+        self.code_table: list = []
+        self.table_size = 0
+
+        # Values to output
+        self.buffer: MutableSequence[int] = bytearray()
 
-        # Codes and values to output
         self.codes: list[int] = []
-        self.values: list[int] = []
+        self.reset(min_code_size, expected_values)
+
+    def reset(self, min_code_size: int, expected_values: int | None = None) -> None:
+        """
+        Start decoding a new image, reusing the code table and output buffer.
+        """
+        assert min_code_size < self.max_code_size
+
+        self.min_code_size = min_code_size
+        self.expected_values = expected_values
+
+        # Codes read
+        self.codes.clear()
+        self.n_codes = 0
+        self.n_clears = 0
+        self.codes_per_width = [0] * (self.max_code_size + 1)
+        self.n_table_fills = 0
+        self.n_fed = 0
+        self.first_code: int | None = None
+        self.received_eoi = False
+
+        # Values and code table entries are bytes unless the code size is
+        # invalid for GIF
+        n_initial_codes = 2**min_code_size
+        use_bytes = min_code_size <= 8
+        if use_bytes:
+            initial_codes: list = _SINGLE_VALUES[:n_initial_codes]
+            empty_code: bytes | tuple = b""
+        else:
+            initial_codes = [(i,) for i in range(n_initial_codes)]
+            empty_code = ()
+        if len(self.code_table) == 0 or isinstance(self.buffer, bytearray) != use_bytes:
+            self.code_table = [empty_code] * 2**self.max_code_size
+            self.buffer = bytearray() if use_bytes else []
+        self.code_table[:n_initial_codes] = initial_codes
+        self.code_table[n_initial_codes] = empty_code
+        self.code_table[n_initial_codes + 1] = empty_code
+        self.table_size = n_initial_codes + 2
+
+        # Values are written over the existing buffer, which is grown in feed()
+        self.n_values = 0
         self.n_used = 0
 
-        # Code table
-        self.clear_code = 2**min_code_size
+        # Set once expected_values have been decoded, after which codes and bytes
+        # are counted but ignored
+        self.full = expected_values == 0
+        self.n_excess_codes = 0
+        self.n_excess_bytes = 0
+
+        self.clear_code = n_initial_codes
         self.eoi_code = self.clear_code + 1
-        self.code_table = []
-        for i in range(2**min_code_size):
-            self.code_table.append((i,))
-        self.code_table.append(self.clear_code)
-        self.code_table.append(self.eoi_code)
 
         # Code currently being decoded
         self.code = 0  # Current bits of code
@@ -154,80 +532,280 @@ class LZWDecoder:
         self.code_size = self.min_code_size + 1  # Required number of bits
         self.last_code = self.clear_code  # Previous code processed
 
-    def feed(self, data: bytes, offset: int = 0, length: int = -1) -> None:
+    @property
+    def values(self) -> MutableSequence[int]:
+        """
+        Copy of the values decoded so far. This is a bytearray for code sizes up
+        to 8, and a list for larger ones - before version 0.6 it was always a
+        list.
+        """
+        return self.buffer[: self.n_values]
+
+    def feed(self, data: bytes | memoryview, offset: int = 0, length: int = -1) -> None:
+        # Data after the end of information code is not used
+        if self.received_eoi:
+            self.n_fed += len(data) - offset if length < 0 else length
+            return
         if length < 0:
             length = len(data) - offset
-        for i in range(offset, offset + length):
-            d = data[i]
-            self.n_used += 1
-            n_available = 8
-            while n_available > 0:
-                # Number of bits to get
-                n_bits = min(self.code_size - self.code_bits, n_available)
-
-                # Extract bits from octet
-                new_bits = d & ((1 << n_bits) - 1)
-                d >>= n_bits
-                n_available -= n_bits
-
-                # Add new bits to the top of the code
-                self.code = new_bits << self.code_bits | self.code
-                self.code_bits += n_bits
-
-                # Keep going until we get a full code word
-                if self.code_bits < self.code_size:
-                    continue
-                code = self.code
-                self.code = 0
-                self.code_bits = 0
-                self.codes.append(code)
-
-                # Stop on end of information code
-                if code == self.eoi_code:
-                    return
-
-                # Reset code table on clear
-                if code == self.clear_code:
-                    self.code_size = self.min_code_size + 1
-                    self.code_table = self.code_table[: self.eoi_code + 1]
-                    self.last_code = code
-                    continue
-
-                if code < len(self.code_table):
-                    for v in self.code_table[code]:
-                        self.values.append(v)
-                    if (
-                        self.last_code != self.clear_code
-                        and len(self.code_table) < 2**self.max_code_size - 1
-                    ):
-                        self.code_table.append(
-                            self.code_table[self.last_code]
-                            + (self.code_table[code][0],)
-                        )
-                        assert len(self.code_table) < 2**self.max_code_size
+        self.n_fed += length
+        if offset != 0 or length != len(data):
+            data = memoryview(data)[offset : offset + length]
+
+        # State is kept in local variables while decoding as this is much faster
+        # than using attributes
+        code_table = self.code_table
+        table_size = self.table_size
+        buffer = self.buffer
+        clear_code = self.clear_code
+        eoi_code = self.eoi_code
+        max_table_size = 2**self.max_code_size
+        if self.expected_values is not None:
+            self._grow_buffer()
+        check_limits = self.max_values is not None or self.max_ratio is not None
+        if self.expected_values is None:
+            expected_values = -1
+        else:
+            expected_values = self.expected_values
+        bits = self.code
+        n_bits = self.code_bits
+        code_size = self.code_size
+        code_mask = (1 << code_size) - 1
+        last_code = self.last_code
+        n_values = self.n_values
+        full = self.full
+        n_used = self.n_used
+        n_codes = self.n_codes
+
+        # Codes are counted for each width when the width changes
+        codes_per_width = self.codes_per_width
+        width_start = n_codes
+        start = n_used
+        try:
+            for octet in data:
+                # Once full the remaining codes are counted in _count_codes()
+                if full:
+                    break
+                n_used += 1
+                bits |= octet << n_bits
+                n_bits += 8
+                while n_bits >= code_size:
+                    code = bits & code_mask
+                    bits >>= code_size
+                    n_bits -= code_size
+                    if self.keep_codes:
+                        self.codes.append(code)
+                    if n_codes == 0:
+                        self.first_code = code
+                    n_codes += 1
+
+                    # Stop on end of information code
+                    if code == eoi_code:
+                        bits = 0
+                        n_bits = 0
+                        self.received_eoi = True
+                        return
+
+                    if full:
+                        self.n_excess_codes += 1
+
+                    # Reset code table on clear
+                    if code == clear_code:
+                        self.n_clears += 1
+                        codes_per_width[code_size] += n_codes - width_start
+                        width_start = n_codes
+                        code_size = self.min_code_size + 1
+                        code_mask = (1 << code_size) - 1
+                        table_size = eoi_code + 1
+                        last_code = code
+                        continue
+
+                    # Add a new code made from the previous code and the first
+                    # value of this one
+                    if code < table_size:
+                        entry = code_table[code]
+                        adds_entry = last_code != clear_code
+                    elif code == table_size and last_code != clear_code:
+                        # Code is the one being added
+                        entry = None
+                        adds_entry = True
+                    else:
+                        print("Ignoring unexpected code %d" % code)
+                        continue
+                    if adds_entry and table_size < max_table_size:
+                        # Once full the entries aren't used, so only the code
+                        # size is tracked
+                        if not full:
+                            last_entry = code_table[last_code]
+                            first = last_entry if entry is None else entry
+                            code_table[table_size] = last_entry + first[:1]
+                        table_size += 1
                         if (
-                            len(self.code_table) == 2**self.code_size
-                            and self.code_size < self.max_code_size
+                            table_size == 1 << code_size
+                            and code_size < self.max_code_size
                         ):
-                            self.code_size += 1
-                    self.last_code = code
-                elif code == len(self.code_table):
-                    if len(self.code_table) < 2**self.max_code_size - 1:
-                        self.code_table.append(
-                            self.code_table[self.last_code]
-                            + (self.code_table[self.last_code][0],)
-                        )
-                        assert len(self.code_table) < 2**self.max_code_size
+                            codes_per_width[code_size] += n_codes - width_start
+                            width_start = n_codes
+                            code_size += 1
+                            code_mask = (1 << code_size) - 1
+                        elif table_size == max_table_size - 1:
+                            # The encoder adds each entry a code before the
+                            # decoder can, so its table is now full
+                            self.n_table_fills += 1
+                    last_code = code
+
+                    # Once full the remaining codes are only counted
+                    if full:
+                        continue
+                    if entry is None:
+                        entry = code_table[table_size - 1]
+                    end = n_values + len(entry)
+                    if expected_values >= 0 and end >= expected_values:
+                        entry = entry[: expected_values - n_values]
+                        end = expected_values
+                        full = True
+                    if check_limits:
+                        self.n_values = n_values
+                        self.n_used = n_used
+                        self._check_limits(len(entry))
+                    buffer[n_values:end] = entry
+                    n_values = end
+        finally:
+            codes_per_width[code_size] += n_codes - width_start
+            self.table_size = table_size
+            self.code = bits
+            self.code_bits = n_bits
+            self.code_size = code_size
+            self.last_code = last_code
+            self.n_values = n_values
+            self.full = full
+            self.n_used = n_used
+            self.n_codes = n_codes
+        if full:
+            self._count_codes(memoryview(data)[n_used - start :])
+
+    def _count_codes(self, data: bytes | memoryview) -> None:
+        # Read the codes after expected_values have been decoded. Only the size
+        # of the code table is tracked, to know the width of each code
+        table_size = self.table_size
+        clear_code = self.clear_code
+        eoi_code = self.eoi_code
+        max_table_size = 2**self.max_code_size
+        codes = self.codes if self.keep_codes else None
+        bits = self.code
+        n_bits = self.code_bits
+        code_size = self.code_size
+        code_mask = (1 << code_size) - 1
+        last_code = self.last_code
+        n_codes = self.n_codes
+        n_excess_codes = self.n_excess_codes
+        n_bytes = 0
+
+        codes_per_width = self.codes_per_width
+        width_start = n_codes
+        try:
+            for octet in data:
+                n_bytes += 1
+                bits |= octet << n_bits
+                n_bits += 8
+                while n_bits >= code_size:
+                    code = bits & code_mask
+                    bits >>= code_size
+                    n_bits -= code_size
+                    if codes is not None:
+                        codes.append(code)
+                    if n_codes == 0:
+                        self.first_code = code
+                    n_codes += 1
+
+                    if code == eoi_code:
+                        bits = 0
+                        n_bits = 0
+                        self.received_eoi = True
+                        return
+                    n_excess_codes += 1
+
+                    if code == clear_code:
+                        self.n_clears += 1
+                        codes_per_width[code_size] += n_codes - width_start
+                        width_start = n_codes
+                        code_size = self.min_code_size + 1
+                        code_mask = (1 << code_size) - 1
+                        table_size = eoi_code + 1
+                        last_code = code
+                        continue
+
+                    if code > table_size or (
+                        code == table_size and last_code == clear_code
+                    ):
+                        print("Ignoring unexpected code %d" % code)
+                        continue
+                    if last_code != clear_code and table_size < max_table_size:
+                        table_size += 1
                         if (
-                            len(self.code_table) == 2**self.code_size
-                            and self.code_size < self.max_code_size
+                            table_size == 1 << code_size
+                            and code_size < self.max_code_size
                         ):
-                            self.code_size += 1
-                    for v in self.code_table[-1]:
-                        self.values.append(v)
-                    self.last_code = code
-                else:
-                    print("Ignoring unexpected code %d" % code)
+                            codes_per_width[code_size] += n_codes - width_start
+                            width_start = n_codes
+                            code_size += 1
+                            code_mask = (1 << code_size) - 1
+                        elif table_size == max_table_size - 1:
+                            self.n_table_fills += 1
+                    last_code = code
+        finally:
+            codes_per_width[code_size] += n_codes - width_start
+            self.table_size = table_size
+            self.code = bits
+            self.code_bits = n_bits
+            self.code_size = code_size
+            self.last_code = last_code
+            self.n_used += n_bytes
+            self.n_codes = n_codes
+            self.n_excess_codes = n_excess_codes
+            self.n_excess_bytes += n_bytes
+
+    def _grow_buffer(self) -> None:
+        # Each code is at least min_code_size + 1 bits and can't decode to more
+        # values than there are code table entries
+        assert self.expected_values is not None
+        size = min(
+            self.expected_values,
+            self.n_fed * 8 // (self.min_code_size + 1) * 2**self.max_code_size,
+        )
+        if self.max_values is not None:
+            size = min(size, self.max_values)
+        if self.max_ratio is not None:
+            size = min(size, int(self.max_ratio * self.n_fed))
+        if len(self.buffer) < size:
+            self.buffer.extend(bytes(size - len(self.buffer)))
+
+    def _check_limits(self, n_values: int) -> None:
+        n_values += self.n_values
+        if self.max_values is not None and n_values > self.max_values:
+            raise LimitExceededError("Decoded values", n_values, self.max_values)
+        if self.max_ratio is not None and n_values > self.max_ratio * self.n_used:
+            raise LimitExceededError(
+                "Compression ratio", round(n_values / self.n_used, 1), self.max_ratio
+            )
 
     def is_complete(self) -> bool:
-        return len(self.codes) > 0 and self.codes[-1] == self.eoi_code
+        return self.received_eoi
+
+    def get_stats(self) -> "LZWStats":
+        """
+        Get statistics about the codes decoded so far.
+        """
+        return LZWStats(
+            self.min_code_size,
+            {
+                width: n_codes
+                for width, n_codes in enumerate(self.codes_per_width)
+                if n_codes > 0
+            },
+            self.n_clears,
+            self.n_table_fills,
+            self.n_values,
+            self.n_used,
+            self.n_fed - self.n_used,
+        )
@@ -0,0 +1,367 @@
+# Copyright 2018 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License version 3, as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranties of MERCHANTABILITY,
+# SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Lesser
+# General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import io
+from concurrent.futures import ProcessPoolExecutor
+
+from gif.image import (
+    GraphicControlExtension,
+    Image,
+    PlainTextExtension,
+    Trailer,
+    UnknownBlock,
+    _join_subblocks,
+)
+from gif.lzw import LZWDecoder, LZWEncoder
+from gif.palette import Palette
+from gif.reader import Reader
+from gif.writer import Writer
+
+__all__ = ["optimize"]
+
+
+class _ImagePlan:
+    """
+    How an image is rewritten: its values are mapped through table and it
+    uses color_table (the global color table if None).
+    """
+
+    def __init__(
+        self,
+        table: bytes,
+        color_table: Palette | None,
+        depth: int,
+        transparent_color: int | None,
+    ) -> None:
+        self.table = table
+        self.color_table = color_table
+        self.depth = depth
+        self.transparent_color = transparent_color
+
+
+def optimize(reader: Reader, workers: int | None = None) -> bytes:
+    """
+    Rewrite the GIF in reader to be smaller while showing the same pixels.
+
+    Unused color table entries are removed, local color tables that only use
+    colors from the global color table are dropped, and images are re-encoded
+    with the smallest LZW code size and whichever clear code strategy gives
+    the smallest data. Each re-encoded image is decoded and checked against
+    the original pixels. Other blocks are copied unchanged.
+
+    Images are decoded and encoded using a pool of workers processes (one per
+    CPU if None). Images that can't be decoded cleanly are copied as they
+    are. If the result isn't smaller the original data is returned.
+    """
+    original = bytes(reader.buffer)
+    if not reader.is_complete():
+        return original
+
+    images: list[Image] = []
+    controls: dict[int, GraphicControlExtension] = {}
+    control = None
+    has_plain_text = False
+    for block in reader.blocks:
+        if isinstance(block, GraphicControlExtension):
+            control = block
+        elif isinstance(block, Image):
+            if control is not None:
+                controls[len(images)] = control
+            images.append(block)
+            control = None
+        elif isinstance(block, PlainTextExtension):
+            has_plain_text = True
+            control = None
+
+    executor = None
+    if (workers is None or workers > 1) and len(images) > 1:
+        executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        map_ = executor.map if executor is not None else map
+        pixels = list(
+            map_(
+                _decode,
+                [
+                    (
+                        image.lzw_min_code_size,
+                        image.width * image.height,
+                        image.get_lzw_data(),
+                    )
+                    for image in images
+                ],
+            )
+        )
+        (global_table, background_color, plans) = _plan(
+            reader, images, controls, pixels, not has_plain_text
+        )
+        encode_images = []
+        jobs = []
+        for i, plan in enumerate(plans):
+            image_pixels = pixels[i]
+            if plan is not None and image_pixels is not None:
+                encode_images.append(i)
+                jobs.append((image_pixels.translate(plan.table), max(plan.depth, 2)))
+        encoded = dict(zip(encode_images, map_(_encode, jobs)))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    file = io.BytesIO()
+    writer = Writer(file)
+    writer.write_header(reader.version)
+    global_depth = _get_depth(len(global_table))
+    writer.write_screen_descriptor(
+        reader.width,
+        reader.height,
+        has_color_table=len(global_table) > 0,
+        depth=global_depth,
+        colors_sorted=reader.color_table_sorted,
+        original_depth=reader.original_depth,
+        background_color=background_color,
+        pixel_aspect_ratio=reader.pixel_aspect_ratio,
+    )
+    if len(global_table) > 0:
+        writer.write_color_table(global_table, global_depth)
+    n_images = 0
+    for block in reader.blocks:
+        if isinstance(block, GraphicControlExtension):
+            continue
+        elif isinstance(block, Image):
+            plan = plans[n_images]
+            control = controls.get(n_images)
+            if control is not None:
+                _write_control(writer, control, plan)
+            if plan is None:
+                writer.write_raw_block(block)
+            else:
+                _write_image(writer, block, plan, encoded[n_images])
+            n_images += 1
+        elif isinstance(block, (Trailer, UnknownBlock)):
+            break
+        else:
+            if isinstance(block, PlainTextExtension):
+                # Plain text uses the control extension before it
+                index = reader.blocks.index(block)
+                previous = reader.blocks[index - 1] if index > 0 else None
+                if isinstance(previous, GraphicControlExtension):
+                    writer.write_raw_block(previous)
+            writer.write_raw_block(block)
+    writer.write_trailer()
+
+    data = file.getvalue()
+    if len(data) >= len(original):
+        return original
+    return data
+
+
+def _decode(args: tuple[int, int, bytes]) -> bytes | None:
+    (min_code_size, n_pixels, data) = args
+    if min_code_size > 8:
+        return None
+    decoder = LZWDecoder(min_code_size, expected_values=n_pixels)
+    decoder.feed(data)
+    if decoder.n_values != n_pixels:
+        return None
+    return bytes(decoder.values)
+
+
+def _encode(args: tuple[bytes, int]) -> bytes:
+    (pixels, min_code_size) = args
+    candidates = []
+    for clear_on_max_width in (True, False):
+        file = io.BytesIO()
+        encoder = LZWEncoder(
+            file, min_code_size=min_code_size, clear_on_max_width=clear_on_max_width
+        )
+        encoder.feed(pixels)
+        encoder.finish()
+        candidates.append(file.getvalue())
+
+    # Use the smallest data that decodes back to the same pixels, falling back
+    # to store mode which only writes literal codes
+    for data in sorted(candidates, key=len):
+        if _decode((min_code_size, len(pixels), _join_subblocks(data, 1))) == pixels:
+            return data
+    file = io.BytesIO()
+    encoder = LZWEncoder(file, min_code_size=min_code_size, store=True)
+    encoder.feed(pixels)
+    encoder.finish()
+    return file.getvalue()
+
+
+def _plan(
+    reader: Reader,
+    images: list[Image],
+    controls: dict[int, GraphicControlExtension],
+    pixels: list[bytes | None],
+    can_reorder_global: bool,
+) -> tuple[Palette, int, list[_ImagePlan | None]]:
+    global_table = reader.color_table
+    global_indexes: dict[tuple[int, int, int], int] = {}
+    for i, color in enumerate(global_table):
+        global_indexes.setdefault(color, i)
+
+    # Work out the values used by each image, and which global color table
+    # entries they map to. Images that can't be decoded or use values outside
+    # the color table are left as they are
+    used_values: list[list[int] | None] = []
+    global_maps: list[dict[int, int] | None] = []
+    transparent_colors: list[int | None] = []
+    for i, image in enumerate(images):
+        control = controls.get(i)
+        if control is not None and control.has_transparent:
+            transparent_color = control.transparent_color
+        else:
+            transparent_color = None
+        transparent_colors.append(transparent_color)
+        if len(image.color_table) > 0:
+            image_color_table = image.color_table
+        else:
+            image_color_table = global_table
+        values = set(pixels[i] or b"")
+        if transparent_color is not None:
+            values.add(transparent_color)
+        if (
+            pixels[i] is None
+            or len(values) == 0
+            or max(values) >= len(image_color_table)
+        ):
+            used_values.append(None)
+            global_maps.append(None)
+            if len(image.color_table) == 0:
+                can_reorder_global = False
+            continue
+        used_values.append(sorted(values))
+        if len(image.color_table) == 0:
+            global_maps.append({value: value for value in values})
+        else:
+            global_maps.append(
+                _map_to_global(
+                    image.color_table,
+                    values,
+                    transparent_color,
+                    global_indexes,
+                    len(global_table),
+                )
+            )
+
+    # Remove unused global colors
+    if can_reorder_global and len(global_table) > 0:
+        used_global = set()
+        if reader.background_color < len(global_table):
+            used_global.add(reader.background_color)
+        for global_map in global_maps:
+            if global_map is not None:
+                used_global.update(global_map.values())
+        global_order = sorted(used_global)
+        global_table = Palette.from_colors(
+            [reader.color_table[i] for i in global_order]
+        )
+        new_global_indexes = {index: i for i, index in enumerate(global_order)}
+    else:
+        new_global_indexes = {i: i for i in range(len(global_table))}
+    background_color = new_global_indexes.get(
+        reader.background_color, reader.background_color
+    )
+
+    plans: list[_ImagePlan | None] = []
+    for i, image in enumerate(images):
+        image_values = used_values[i]
+        global_map = global_maps[i]
+        if image_values is None:
+            plans.append(None)
+            continue
+        table = bytearray(range(256))
+        color_table: Palette | None
+        if global_map is not None:
+            for value, index in global_map.items():
+                table[value] = new_global_indexes[index]
+            color_table = None
+            depth = _get_depth(len(global_table))
+        else:
+            for index, value in enumerate(image_values):
+                table[value] = index
+            color_table = Palette.from_colors(
+                [image.color_table[value] for value in image_values]
+            )
+            depth = _get_depth(len(color_table))
+        transparent_color = transparent_colors[i]
+        if transparent_color is not None:
+            transparent_color = table[transparent_color]
+        plans.append(_ImagePlan(bytes(table), color_table, depth, transparent_color))
+
+    return (global_table, background_color, plans)
+
+
+def _map_to_global(
+    color_table: Palette,
+    values: set[int],
+    transparent_color: int | None,
+    global_indexes: dict[tuple[int, int, int], int],
+    n_global_colors: int,
+) -> dict[int, int] | None:
+    # Only use the global color table if it doesn't need a larger code size
+    if n_global_colors == 0 or _get_depth(n_global_colors) > _get_depth(len(values)):
+        return None
+    global_map = {}
+    for value in values:
+        if value == transparent_color:
+            continue
+        index = global_indexes.get(color_table[value])
+        if index is None:
+            return None
+        global_map[value] = index
+
+    # Transparent color can be any index not used by another color
+    if transparent_color is not None:
+        used = set(global_map.values())
+        for index in global_indexes.values():
+            if index not in used:
+                global_map[transparent_color] = index
+                break
+        else:
+            return None
+
+    return global_map
+
+
+def _get_depth(n_colors: int) -> int:
+    return max((n_colors - 1).bit_length(), 1)
+
+
+def _write_control(
+    writer: Writer, control: GraphicControlExtension, plan: _ImagePlan | None
+) -> None:
+    data = bytearray(control.get_data())
+    if plan is not None and plan.transparent_color is not None and len(data) >= 7:
+        data[6] = plan.transparent_color
+    writer.file.write(data)
+
+
+def _write_image(writer: Writer, image: Image, plan: _ImagePlan, data: bytes) -> None:
+    flags = image.data[image.offset + 9]
+    writer.write_image_descriptor(
+        image.left,
+        image.top,
+        image.width,
+        image.height,
+        has_color_table=plan.color_table is not None,
+        depth=plan.depth if plan.color_table is not None else 1,
+        interlace=image.interlace,
+        colors_sorted=image.color_table_sorted,
+        reserved=(flags >> 3) & 0x3,
+    )
+    if plan.color_table is not None:
+        writer.write_color_table(plan.color_table, plan.depth)
+    writer.file.write(data)
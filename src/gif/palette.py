@@ -0,0 +1,122 @@
+# Copyright 2018 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License version 3, as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranties of MERCHANTABILITY,
+# SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Lesser
+# General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import struct
+import weakref
+from collections.abc import Iterator, Sequence
+
+__all__ = ["Palette"]
+
+# Color used for indexes outside the palette
+_INVALID_RGB = b"\x00\x00\x00"
+_TRANSPARENT = b"\x00\x00\x00\x00"
+
+# Palettes created with Palette.from_bytes(), so identical tables share one
+# object (and its lookup tables)
+_palettes: "weakref.WeakValueDictionary[bytes, Palette]" = weakref.WeakValueDictionary()
+
+
+class Palette(Sequence[tuple[int, int, int]]):
+    """
+    GIF color table, stored as the raw RGB bytes from the file.
+
+    Colors are accessed as (red, green, blue) tuples. Lookup tables that map
+    indexes to RGB or RGBA bytes are created on first use and kept.
+    """
+
+    def __init__(self, data: bytes = b"") -> None:
+        assert len(data) % 3 == 0
+        self.data = bytes(data)
+        self._lookups: dict[tuple, list[bytes]] = {}
+
+    @classmethod
+    def from_bytes(cls, data: bytes | bytearray) -> "Palette":
+        """
+        Get the palette with these RGB bytes, reusing an existing one if
+        possible.
+        """
+        data = bytes(data)
+        palette = _palettes.get(data)
+        if palette is None:
+            palette = cls(data)
+            _palettes[data] = palette
+        return palette
+
+    @classmethod
+    def from_colors(cls, colors) -> "Palette":
+        return cls.from_bytes(
+            b"".join([struct.pack("BBB", *color) for color in colors])
+        )
+
+    def __len__(self) -> int:
+        return len(self.data) // 3
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("Palette index out of range")
+        return (
+            self.data[index * 3],
+            self.data[index * 3 + 1],
+            self.data[index * 3 + 2],
+        )
+
+    def __iter__(self) -> Iterator[tuple[int, int, int]]:
+        return struct.iter_unpack("BBB", self.data)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, Palette):
+            return self.data == other.data
+        if isinstance(other, Sequence):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        return hash(self.data)
+
+    def __repr__(self) -> str:
+        return "Palette(%s)" % repr(list(self))
+
+    def get_rgb_lookup(self, n_values: int = 256) -> list[bytes]:
+        """
+        Get RGB bytes for each index below n_values. Indexes outside the
+        palette are black.
+        """
+        key = ("rgb", n_values)
+        lookup = self._lookups.get(key)
+        if lookup is None:
+            data = self.data
+            lookup = [data[i : i + 3] for i in range(0, len(data), 3)][:n_values]
+            lookup.extend([_INVALID_RGB] * (n_values - len(lookup)))
+            self._lookups[key] = lookup
+        return lookup
+
+    def get_rgba_lookup(
+        self, transparent_color: int | None = None, n_values: int = 256
+    ) -> list[bytes]:
+        """
+        Get RGBA bytes for each index below n_values. The transparent color is
+        (0, 0, 0, 0) and indexes outside the palette are opaque black.
+        """
+        key = ("rgba", transparent_color, n_values)
+        lookup = self._lookups.get(key)
+        if lookup is None:
+            lookup = [color + b"\xff" for color in self.get_rgb_lookup(n_values)]
+            if transparent_color is not None and transparent_color < n_values:
+                lookup[transparent_color] = _TRANSPARENT
+            self._lookups[key] = lookup
+        return lookup
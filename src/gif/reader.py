@@ -14,6 +14,8 @@
 
 import struct
 
+from gif.cache import DecodeCache
+from gif.errors import LimitExceededError
 from gif.image import (
     AnimationExtension,
     ApplicationExtension,
@@ -33,17 +35,60 @@ from gif.image import (
     XMPDataExtension,
     _get_subblocks,
 )
+from gif.lzw import LZWDecoder
+from gif.palette import Palette
 
 
 class Reader:
     """
     GIF decoder in pure Python.
+
+    Limits can be set to reject files that would use too many resources. A
+    LimitExceededError is raised from feed() as soon as the screen descriptor
+    or an image descriptor exceeding a limit is read. max_decoded_bytes limits
+    the total number of pixels in all images (one byte per pixel).
+
+    Images read check max_frame_pixels and max_compression_ratio while being
+    decoded, so streams that expand beyond these are stopped before the pixels
+    are stored.
+
+    If decode_cache is set, decoded pixels are kept in it so repeated images
+    are only decoded once. Images then return the cached bytes from
+    get_pixels(), shared with every image that has the same data. Cached
+    pixels are checked against max_frame_pixels and max_compression_ratio.
+
+    Data is added to one buffer that all blocks refer to, so feeding a file in
+    chunks keeps only one copy of it. feed() can't grow the buffer while
+    memoryviews of it exist.
+
+    Blocks are not changed once they have been read, so after feed() has
+    returned, images can be decoded from many threads at once. Each decode
+    takes its own LZWDecoder from a shared pool, and the decode cache has its
+    own locking. feed() must not be called while other threads are using the
+    reader.
     """
 
     def __init__(
         self,
+        max_width: int | None = None,
+        max_height: int | None = None,
+        max_frames: int | None = None,
+        max_decoded_bytes: int | None = None,
+        max_frame_pixels: int | None = None,
+        max_compression_ratio: float | None = None,
+        decode_cache: DecodeCache | None = None,
     ) -> None:
-        self.buffer = b""
+        self.max_width = max_width
+        self.max_height = max_height
+        self.max_frames = max_frames
+        self.max_decoded_bytes = max_decoded_bytes
+        self.max_frame_pixels = max_frame_pixels
+        self.max_compression_ratio = max_compression_ratio
+        self.n_frames = 0
+        self.n_decoded_bytes = 0
+        self.decoder_pool: list[LZWDecoder] = []
+        self.decode_cache = decode_cache
+        self.buffer = bytearray()
         self.version = b""
         self.width = 0
         self.height = 0
@@ -51,15 +96,19 @@ class Reader:
         self.color_table_sorted = False
         self.background_color = 0
         self.pixel_aspect_ratio = 0
-        self.color_table: list[tuple[int, int, int]] = []
+        self.color_table = Palette()
         self.blocks: list[Block] = []
 
+        # Subblocks found so far in an incomplete block (offset, subblocks,
+        # n_complete), so scanning continues from there when more data arrives
+        self._partial_subblocks: tuple[int, list[tuple[int, int]], int] | None = None
+
     def feed(self, data: bytes) -> None:
         old_len = len(self.buffer)
         self.buffer += data
 
         if old_len < 6 and len(self.buffer) >= 6:
-            self.version = self.buffer[:6]
+            self.version = bytes(self.buffer[:6])
 
         # Read logical screen descriptor
         if old_len < 13 and len(self.buffer) >= 13:
@@ -71,23 +120,19 @@ class Reader:
                 self.background_color,
                 self.pixel_aspect_ratio,
             ) = struct.unpack("<6sHHBBB", self.buffer[:13])
+            self._check_size(self.width, self.height)
             has_color_table = flags & 0x80 != 0
             self.original_depth = ((flags >> 4) & 0x7) + 1
             self.color_table_sorted = flags & 0x08 != 0
             color_table_size = flags & 0x7
             if has_color_table:
-                self.color_table = [(0, 0, 0)] * (2 ** (color_table_size + 1))
+                self.color_table = Palette(bytes(2 ** (color_table_size + 1) * 3))
 
         # Read color table
         n_colors = len(self.color_table)
         header_size = 13 + n_colors * 3
-        if old_len < header_size and len(data) >= header_size:
-            for i in range(n_colors):
-                offset = 13 + i * 3
-                (red, green, blue) = struct.unpack(
-                    "BBB", self.buffer[offset : offset + 3]
-                )
-                self.color_table[i] = (red, green, blue)
+        if old_len < header_size and len(self.buffer) >= header_size:
+            self.color_table = Palette.from_bytes(self.buffer[13:header_size])
 
         # Read blocks
         while not self.is_complete() and not self.has_unknown_block():
@@ -115,6 +160,14 @@ class Reader:
                 interlace = flags & 0x40 != 0
                 color_table_sorted = flags & 0x20 != 0
                 color_table_size = flags & 0x7
+                self._check_size(width, height)
+                self._check_limit("Frame pixels", width * height, self.max_frame_pixels)
+                self._check_limit("Frame count", self.n_frames + 1, self.max_frames)
+                self._check_limit(
+                    "Decoded size",
+                    self.n_decoded_bytes + width * height,
+                    self.max_decoded_bytes,
+                )
 
                 # Check enough space for color table
                 n_colors = 2 ** (color_table_size + 1)
@@ -128,22 +181,20 @@ class Reader:
                     return
                 lzw_min_code_size = self.buffer[block_start + block_length]
                 block_length += 1
-                (subblock_offsets, subblocks_length) = _get_subblocks(
-                    self.buffer, block_start + block_length
+                (subblock_offsets, subblocks_length) = self._get_subblocks(
+                    block_start + block_length
                 )
                 if subblock_offsets is None:
                     return
                 block_length += subblocks_length
 
                 # Read color table
-                color_table = []
                 if has_color_table:
-                    for i in range(n_colors):
-                        offset = block_start + 10 + i * 3
-                        (red, green, blue) = struct.unpack(
-                            "BBB", self.buffer[offset : offset + 3]
-                        )
-                        color_table.append((red, green, blue))
+                    color_table = Palette.from_bytes(
+                        self.buffer[block_start + 10 : block_start + 10 + n_colors * 3]
+                    )
+                else:
+                    color_table = Palette.from_bytes(b"")
 
                 self.blocks.append(
                     Image(
@@ -158,8 +209,14 @@ class Reader:
                         color_table_sorted,
                         interlace,
                         lzw_min_code_size,
+                        max_pixels=self.max_frame_pixels,
+                        max_compression_ratio=self.max_compression_ratio,
+                        decoder_pool=self.decoder_pool,
+                        decode_cache=self.decode_cache,
                     )
                 )
+                self.n_frames += 1
+                self.n_decoded_bytes += width * height
 
             # Extension
             elif block_type == BlockType.EXTENSION:
@@ -169,8 +226,8 @@ class Reader:
                 label = self.buffer[block_start + 1]
 
                 # Check enough space for blocks
-                (subblock_offsets, subblocks_length) = _get_subblocks(
-                    self.buffer, block_start + block_length
+                (subblock_offsets, subblocks_length) = self._get_subblocks(
+                    block_start + block_length
                 )
                 if subblock_offsets is None:
                     return
@@ -178,7 +235,7 @@ class Reader:
 
                 if len(subblock_offsets) > 0:
                     (offset, length) = subblock_offsets[0]
-                    first_subblock = self.buffer[offset : offset + length]
+                    first_subblock = bytes(self.buffer[offset : offset + length])
                 else:
                     first_subblock = b""
 
@@ -279,3 +336,25 @@ class Reader:
 
     def has_unknown_block(self) -> bool:
         return len(self.blocks) > 0 and isinstance(self.blocks[-1], UnknownBlock)
+
+    def _get_subblocks(self, offset: int) -> tuple[list[tuple[int, int]] | None, int]:
+        if self._partial_subblocks is not None and self._partial_subblocks[0] == offset:
+            (_, subblocks, n_complete) = self._partial_subblocks
+        else:
+            (subblocks, n_complete) = ([], 0)
+        (subblock_offsets, length) = _get_subblocks(
+            self.buffer, offset, subblocks, n_complete
+        )
+        if subblock_offsets is None:
+            self._partial_subblocks = (offset, subblocks, length)
+        else:
+            self._partial_subblocks = None
+        return (subblock_offsets, length)
+
+    def _check_size(self, width: int, height: int) -> None:
+        self._check_limit("Width", width, self.max_width)
+        self._check_limit("Height", height, self.max_height)
+
+    def _check_limit(self, limit: str, value: float, maximum: float | None) -> None:
+        if maximum is not None and value > maximum:
+            raise LimitExceededError(limit, value, maximum)
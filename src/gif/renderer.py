@@ -0,0 +1,303 @@
+# Copyright 2018 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License version 3, as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranties of MERCHANTABILITY,
+# SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Lesser
+# General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import zlib
+from collections.abc import Sequence
+
+from gif.image import (
+    DisposalMethod,
+    GraphicControlExtension,
+    Image,
+    _get_row_order,
+)
+from gif.palette import Palette
+
+__all__ = ["AnimationRenderer", "Frame", "Renderer", "RendererState", "get_frames"]
+
+_TRANSPARENT = b"\x00\x00\x00\x00"
+
+
+class Frame:
+    """
+    An image along with the graphic control values that apply to it.
+    """
+
+    def __init__(
+        self,
+        image: Image,
+        delay_time: int = 0,
+        disposal_method: int = DisposalMethod.NONE,
+        transparent_color: int | None = None,
+    ) -> None:
+        self.image = image
+        self.delay_time = delay_time
+        self.disposal_method = disposal_method
+        self.transparent_color = transparent_color
+
+
+def get_frames(blocks) -> list[Frame]:
+    """
+    Pair each image in blocks with the graphic control extension before it.
+    """
+    frames = []
+    control = None
+    for block in blocks:
+        if isinstance(block, GraphicControlExtension):
+            control = block
+        elif isinstance(block, Image):
+            frames.append(_make_frame(block, control))
+            control = None
+    return frames
+
+
+def _make_frame(image: Image, control: GraphicControlExtension | None) -> Frame:
+    if control is None:
+        return Frame(image)
+    if control.has_transparent:
+        transparent_color = control.transparent_color
+    else:
+        transparent_color = None
+    return Frame(image, control.delay_time, control.disposal_method, transparent_color)
+
+
+class RendererState:
+    """
+    Snapshot of a renderer, with the canvas stored compressed.
+    """
+
+    def __init__(
+        self, pixels: bytes, last_frame: Frame | None, saved_rows: list[bytes]
+    ) -> None:
+        self.pixels = pixels
+        self.last_frame = last_frame
+        self.saved_rows = saved_rows
+
+    def get_size(self) -> int:
+        return len(self.pixels) + sum(len(row) for row in self.saved_rows)
+
+
+class Renderer:
+    """
+    Composites frames onto an RGBA canvas in display order.
+    """
+
+    def __init__(self, width: int, height: int, color_table: Palette) -> None:
+        self.width = width
+        self.height = height
+        self.color_table = color_table
+        self.pixels = bytearray(width * height * 4)
+
+        # Disposal to apply before the next frame is drawn, and the area it
+        # covered before it was drawn (for DisposalMethod.RESTORE_PREVIOUS)
+        self.last_frame: Frame | None = None
+        self.saved_rows: list[bytes] = []
+
+    def reset(self) -> None:
+        self.pixels = bytearray(self.width * self.height * 4)
+        self.last_frame = None
+        self.saved_rows = []
+
+    def render(self, frame: Frame, pixels: Sequence[int] | None = None) -> None:
+        """
+        Draw frame after disposing of the previous one. The image is decoded
+        unless its pixels are given (e.g. if they were decoded elsewhere).
+        """
+        if self.last_frame is not None:
+            self._dispose(self.last_frame)
+        image = frame.image
+        (left, right) = self._clip(image.left, image.width, self.width)
+        (top, bottom) = self._clip(image.top, image.height, self.height)
+        if frame.disposal_method == DisposalMethod.RESTORE_PREVIOUS:
+            self.saved_rows = [
+                bytes(self.pixels[self._offset(left, y) : self._offset(right, y)])
+                for y in range(top, bottom)
+            ]
+        if pixels is None:
+            pixels = frame.image.get_pixels()
+        self._draw(frame, pixels)
+        self.last_frame = frame
+
+    def get_pixels(self) -> bytes:
+        return bytes(self.pixels)
+
+    def save_state(self) -> "RendererState":
+        return RendererState(
+            zlib.compress(self.pixels, 1), self.last_frame, list(self.saved_rows)
+        )
+
+    def restore_state(self, state: "RendererState") -> None:
+        self.pixels = bytearray(zlib.decompress(state.pixels))
+        self.last_frame = state.last_frame
+        self.saved_rows = list(state.saved_rows)
+
+    def _offset(self, x: int, y: int) -> int:
+        return (y * self.width + x) * 4
+
+    def _clip(self, start: int, length: int, limit: int) -> tuple[int, int]:
+        start = min(start, limit)
+        return (start, min(start + length, limit))
+
+    def _get_color_lookup(
+        self, image: Image, transparent_color: int | None
+    ) -> list[bytes]:
+        if len(image.color_table) > 0:
+            color_table = image.color_table
+        else:
+            color_table = self.color_table
+        n_values = 2 ** min(image.lzw_min_code_size, 12)
+        return color_table.get_rgba_lookup(transparent_color, n_values)
+
+    def _draw(self, frame: Frame, pixels: Sequence[int]) -> None:
+        image = frame.image
+        lookup = self._get_color_lookup(image, frame.transparent_color)
+        (left, right) = self._clip(image.left, image.width, self.width)
+        row_length = right - left
+        transparent_color = frame.transparent_color
+        rows = _get_row_order(image.top, image.height, image.interlace)
+        for i, y in enumerate(rows):
+            start = i * image.width
+            if start >= len(pixels):
+                return
+            if y >= self.height or row_length == 0:
+                continue
+            row = pixels[start : start + row_length]
+            offset = self._offset(left, y)
+            if transparent_color is not None and transparent_color in row:
+                for x, index in enumerate(row):
+                    if index != transparent_color:
+                        self.pixels[offset + x * 4 : offset + x * 4 + 4] = lookup[index]
+            else:
+                self.pixels[offset : offset + len(row) * 4] = b"".join(
+                    [lookup[index] for index in row]
+                )
+
+    def _dispose(self, frame: Frame) -> None:
+        image = frame.image
+        (left, right) = self._clip(image.left, image.width, self.width)
+        (top, bottom) = self._clip(image.top, image.height, self.height)
+        if frame.disposal_method == DisposalMethod.RESTORE_BACKGROUND:
+            row = _TRANSPARENT * (right - left)
+            for y in range(top, bottom):
+                self.pixels[self._offset(left, y) : self._offset(right, y)] = row
+        elif frame.disposal_method == DisposalMethod.RESTORE_PREVIOUS:
+            for y, row in zip(range(top, bottom), self.saved_rows):
+                self.pixels[self._offset(left, y) : self._offset(right, y)] = row
+            self.saved_rows = []
+
+
+class AnimationRenderer:
+    """
+    Renders arbitrary frames of an animation.
+
+    Rendering starts from the closest of: the current frame, the nearest
+    keyframe (see FrameIndex) or the nearest checkpoint. A checkpoint is a
+    compressed snapshot of the canvas stored every checkpoint_interval frames.
+    If the checkpoints use more than checkpoint_memory_limit bytes the interval
+    is doubled and the checkpoints that no longer fall on it are dropped.
+    """
+
+    def __init__(
+        self,
+        width: int,
+        height: int,
+        color_table: Palette,
+        frames: list[Frame],
+        keyframes: list[int] | None = None,
+        checkpoint_interval: int = 0,
+        checkpoint_memory_limit: int = 64 * 1024 * 1024,
+    ) -> None:
+        assert checkpoint_interval >= 0
+        self.renderer = Renderer(width, height, color_table)
+        self.frames = frames
+        if keyframes is None:
+            keyframes = [0] * len(frames)
+        self.keyframes = keyframes
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoint_memory_limit = checkpoint_memory_limit
+        self.checkpoints: dict[int, RendererState] = {}
+        self.checkpoints_size = 0
+
+        # Whether each keyframe used so far has all its pixels
+        self.complete_keyframes: dict[int, bool] = {}
+
+        # Last frame rendered
+        self.frame = -1
+
+    def render_frame(self, frame: int) -> bytes:
+        """
+        Returns frame composited as RGBA pixels.
+        """
+        assert 0 <= frame < len(self.frames)
+
+        # Start from whichever of the keyframe, checkpoint or current frame is
+        # closest
+        start = self._get_keyframe(frame)
+        checkpoint = self._get_checkpoint(frame)
+        if checkpoint is not None and checkpoint < start:
+            checkpoint = None
+        if start <= self.frame <= frame and (
+            checkpoint is None or checkpoint <= self.frame
+        ):
+            start = self.frame + 1
+        elif checkpoint is not None:
+            self.renderer.restore_state(self.checkpoints[checkpoint])
+            start = checkpoint + 1
+        else:
+            self.renderer.reset()
+
+        for i in range(start, frame + 1):
+            self.renderer.render(self.frames[i])
+            if self.checkpoint_interval > 0 and i % self.checkpoint_interval == 0:
+                self._add_checkpoint(i)
+        self.frame = frame
+
+        return self.renderer.get_pixels()
+
+    def _get_keyframe(self, frame: int) -> int:
+        # A keyframe whose image data is truncated doesn't cover the canvas, so
+        # use the keyframe before it
+        keyframe = self.keyframes[frame]
+        while keyframe > 0:
+            if keyframe not in self.complete_keyframes:
+                image = self.frames[keyframe].image
+                self.complete_keyframes[keyframe] = (
+                    len(image.get_pixels()) >= image.width * image.height
+                )
+            if self.complete_keyframes[keyframe]:
+                break
+            keyframe = self.keyframes[keyframe - 1]
+        return keyframe
+
+    def _get_checkpoint(self, frame: int) -> int | None:
+        if self.checkpoint_interval == 0:
+            return None
+        checkpoint = frame - frame % self.checkpoint_interval
+        while checkpoint >= 0:
+            if checkpoint in self.checkpoints:
+                return checkpoint
+            checkpoint -= self.checkpoint_interval
+        return None
+
+    def _add_checkpoint(self, frame: int) -> None:
+        # The first frame never needs a checkpoint
+        if frame == 0 or frame in self.checkpoints:
+            return
+        state = self.renderer.save_state()
+        self.checkpoints[frame] = state
+        self.checkpoints_size += state.get_size()
+        while self.checkpoints_size > self.checkpoint_memory_limit:
+            self.checkpoint_interval *= 2
+            for i in list(self.checkpoints.keys()):
+                if i % self.checkpoint_interval != 0:
+                    self.checkpoints_size -= self.checkpoints.pop(i).get_size()
@@ -0,0 +1,239 @@
+# Copyright 2018 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License version 3, as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranties of MERCHANTABILITY,
+# SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Lesser
+# General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import operator
+import struct
+from collections.abc import Callable
+
+from gif.image import (
+    GraphicControlExtension,
+    Image,
+    Trailer,
+    UnknownBlock,
+    _get_row_order,
+)
+from gif.lzw import LZWEncoder
+from gif.reader import Reader
+from gif.writer import Writer
+
+__all__ = ["crop", "flip", "resize", "rotate"]
+
+# Position, size and rows of an image
+_Rect = tuple[int, int, int, int, list[bytes]]
+
+
+def crop(reader: Reader, file, left: int, top: int, width: int, height: int) -> None:
+    """
+    Write the area of the GIF in reader with the given position and size to
+    file.
+
+    Like the other transforms, this works on the color indexes of each image
+    so no colors are changed, and images are transformed separately without
+    being composited. If an image's data ends early, the missing pixels are
+    made transparent if the frame has a transparent color. Otherwise the
+    image is cut off above the first row that is incomplete.
+    """
+    assert 0 <= left and 0 <= top and 0 <= width and 0 <= height
+
+    def transform(x: int, y: int, w: int, h: int, rows: list[bytes]) -> _Rect:
+        x0 = max(x, left)
+        x1 = min(x + w, left + width)
+        y0 = max(y, top)
+        y1 = min(y + h, top + height)
+        if x1 <= x0 or y1 <= y0:
+            return (0, 0, 0, 0, [])
+        rows = [row[x0 - x : x1 - x] for row in rows[y0 - y : y1 - y]]
+        return (x0 - left, y0 - top, x1 - x0, y1 - y0, rows)
+
+    _transform(reader, file, width, height, transform)
+
+
+def resize(reader: Reader, file, width: int, height: int) -> None:
+    """
+    Write the GIF in reader to file scaled to width x height pixels using
+    nearest neighbour sampling.
+    """
+    assert width > 0 and height > 0
+    assert reader.width > 0 and reader.height > 0
+    screen_width = reader.width
+    screen_height = reader.height
+
+    def transform(x: int, y: int, w: int, h: int, rows: list[bytes]) -> _Rect:
+        # Each image covers the output pixels that sample from inside it
+        x0 = -(-x * width // screen_width)
+        x1 = -(-(x + w) * width // screen_width)
+        y0 = -(-y * height // screen_height)
+        y1 = -(-(y + h) * height // screen_height)
+        if x1 <= x0 or y1 <= y0:
+            return (0, 0, 0, 0, [])
+        columns = [i * screen_width // width - x for i in range(x0, x1)]
+        if len(columns) == 1:
+            column = columns[0]
+
+            def sample(row: bytes) -> bytes:
+                return row[column : column + 1]
+        else:
+            getter = operator.itemgetter(*columns)
+
+            def sample(row: bytes) -> bytes:
+                return bytes(getter(row))
+
+        scaled_rows: dict[int, bytes] = {}
+        new_rows = []
+        for i in range(y0, y1):
+            source = i * screen_height // height - y
+            row = scaled_rows.get(source)
+            if row is None:
+                row = scaled_rows[source] = sample(rows[source])
+            new_rows.append(row)
+        return (x0, y0, x1 - x0, y1 - y0, new_rows)
+
+    _transform(reader, file, width, height, transform)
+
+
+def flip(reader: Reader, file, horizontal: bool = True, vertical: bool = False) -> None:
+    """
+    Write the GIF in reader to file mirrored horizontally and/or vertically.
+    """
+    screen_width = reader.width
+    screen_height = reader.height
+
+    def transform(x: int, y: int, w: int, h: int, rows: list[bytes]) -> _Rect:
+        if horizontal:
+            x = screen_width - x - w
+            rows = [row[::-1] for row in rows]
+        if vertical:
+            y = screen_height - y - h
+            rows = rows[::-1]
+        return (x, y, w, h, rows)
+
+    _transform(reader, file, screen_width, screen_height, transform)
+
+
+def rotate(reader: Reader, file, turns: int = 1) -> None:
+    """
+    Write the GIF in reader to file rotated clockwise by turns of 90 degrees.
+    """
+    turns %= 4
+    if turns == 2:
+        flip(reader, file, horizontal=True, vertical=True)
+        return
+    screen_width = reader.width
+    screen_height = reader.height
+
+    def transform(x: int, y: int, w: int, h: int, rows: list[bytes]) -> _Rect:
+        # Rows of the rotated image are the columns of the original
+        pixels = b"".join(rows)
+        if turns == 1:
+            rows = [pixels[i::w][::-1] for i in range(w)]
+            return (screen_height - y - h, x, h, w, rows)
+        elif turns == 3:
+            rows = [pixels[w - 1 - i :: w] for i in range(w)]
+            return (y, screen_width - x - w, h, w, rows)
+        return (x, y, w, h, rows)
+
+    if turns % 2 == 1:
+        _transform(reader, file, screen_height, screen_width, transform)
+    else:
+        _transform(reader, file, screen_width, screen_height, transform)
+
+
+def _transform(
+    reader: Reader,
+    file,
+    width: int,
+    height: int,
+    transform: Callable[[int, int, int, int, list[bytes]], _Rect],
+) -> None:
+    writer = Writer(file)
+    writer.write_header(reader.version)
+    writer.file.write(struct.pack("<HH", width, height))
+    writer.file.write(reader.buffer[10 : 13 + len(reader.color_table) * 3])
+    encoder = None
+    control = None
+    for block in reader.blocks:
+        if isinstance(block, (Trailer, UnknownBlock)):
+            break
+        elif isinstance(block, Image):
+            (x, y, w, h, rows) = _get_rows(reader, block, control)
+            (x, y, w, h, rows) = transform(x, y, w, h, rows)
+            encoder = _write_image(writer, encoder, block, x, y, w, h, rows)
+            control = None
+        else:
+            if isinstance(block, GraphicControlExtension):
+                control = block
+            writer.write_raw_block(block)
+    writer.write_trailer()
+
+
+def _get_rows(
+    reader: Reader, image: Image, control: GraphicControlExtension | None
+) -> _Rect:
+    # Get rows in display order, clipped to the screen
+    if image.lzw_min_code_size > 8:
+        raise ValueError("Unsupported LZW code size %d" % image.lzw_min_code_size)
+    width = max(min(image.left + image.width, reader.width) - image.left, 0)
+    height = max(min(image.top + image.height, reader.height) - image.top, 0)
+    pixels = bytes(image.get_pixels())
+
+    # Missing pixels are made transparent if possible, otherwise the image is
+    # clipped to the rows before the first one that wasn't fully decoded
+    n_pixels = image.width * image.height
+    if len(pixels) < n_pixels and control is not None and control.has_transparent:
+        pixels += bytes((control.transparent_color,)) * (n_pixels - len(pixels))
+    row_order = list(_get_row_order(0, image.height, image.interlace))
+    n_rows = len(pixels) // image.width if image.width > 0 else image.height
+    if n_rows < image.height:
+        height = min(height, min(row_order[n_rows:]))
+
+    rows = [b""] * image.height
+    for i, y in enumerate(row_order[:n_rows]):
+        rows[y] = pixels[i * image.width : i * image.width + width]
+    return (image.left, image.top, width, height, rows[:height])
+
+
+def _write_image(
+    writer: Writer,
+    encoder: LZWEncoder | None,
+    image: Image,
+    left: int,
+    top: int,
+    width: int,
+    height: int,
+    rows: list[bytes],
+) -> LZWEncoder:
+    has_color_table = len(image.color_table) > 0
+    depth = max(len(image.color_table).bit_length() - 1, 1)
+    flags = image.data[image.offset + 9]
+    writer.write_image_descriptor(
+        left,
+        top,
+        width,
+        height,
+        has_color_table=has_color_table,
+        depth=depth,
+        interlace=image.interlace,
+        colors_sorted=image.color_table_sorted,
+        reserved=(flags >> 3) & 0x3,
+    )
+    if has_color_table:
+        writer.write_color_table(image.color_table, depth)
+    if encoder is None:
+        encoder = LZWEncoder(writer.file, min_code_size=image.lzw_min_code_size)
+    else:
+        encoder.reset(image.lzw_min_code_size)
+    for y in _get_row_order(0, height, image.interlace):
+        encoder.feed(rows[y])
+    encoder.finish()
+    return encoder
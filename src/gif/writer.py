@@ -13,15 +13,35 @@
 # with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import struct
+import tempfile
+from collections.abc import Sequence
+from typing import IO
 
-from gif.image import BlockType, DisposalMethod, ExtensionLabel, Version
+from gif.image import (
+    Block,
+    BlockType,
+    DisposalMethod,
+    ExtensionLabel,
+    Version,
+    _get_row_order,
+)
 from gif.lzw import LZWEncoder
+from gif.palette import Palette
 
 
 class Writer:
     def __init__(self, file) -> None:
         self.file = file
 
+        # Encoder reused for each image
+        self.encoder: LZWEncoder | None = None
+
+        # Image being written with begin_image()
+        self._image_width = 0
+        self._image_height = 0
+        self._image_rows: int | None = None
+        self._interlace_file: IO[bytes] | None = None
+
     def write_header(self, version: bytes = Version.GIF89a) -> None:
         self.file.write(version)
 
@@ -57,13 +77,17 @@ class Writer:
     def write_color(self, red: int, green: int, blue: int) -> None:
         self.file.write(struct.pack("BBB", red, green, blue))
 
-    def write_color_table(self, colors: list[tuple[int, int, int]], depth: int) -> None:
+    def write_color_table(
+        self, colors: Sequence[tuple[int, int, int]], depth: int
+    ) -> None:
         assert 1 <= depth <= 8
         assert len(colors) <= 2**depth
-        for red, green, blue in colors:
-            self.write_color(red, green, blue)
-        for i in range(len(colors), 2**depth):
-            self.write_color(0, 0, 0)
+        if isinstance(colors, Palette):
+            self.file.write(colors.data)
+        else:
+            for red, green, blue in colors:
+                self.write_color(red, green, blue)
+        self.file.write(bytes((2**depth - len(colors)) * 3))
 
     def write_image(
         self,
@@ -73,9 +97,87 @@ class Writer:
         pixels,
         left: int = 0,
         top: int = 0,
-        colors: list[tuple[int, int, int]] = [],
+        colors: Sequence[tuple[int, int, int]] = [],
+        interlace: bool = False,
+        store: bool = False,
+    ) -> None:
+        encoder = self._start_image(
+            width, height, depth, left, top, colors, interlace, store
+        )
+        encoder.feed(pixels)
+        encoder.finish()
+
+    def begin_image(
+        self,
+        width: int,
+        height: int,
+        depth: int,
+        left: int = 0,
+        top: int = 0,
+        colors: Sequence[tuple[int, int, int]] = [],
         interlace: bool = False,
+        store: bool = False,
     ) -> None:
+        """
+        Start writing an image a row at a time with write_rows(). Rows are
+        passed top to bottom, and if interlace is set they are kept in a
+        temporary file until end_image() so they can be written in interlaced
+        order.
+
+        If store is set the image is written without compression (see
+        LZWEncoder), which is much faster.
+        """
+        assert self._image_rows is None
+        self._start_image(width, height, depth, left, top, colors, interlace, store)
+        self._image_width = width
+        self._image_height = height
+        self._image_rows = 0
+        if interlace:
+            # Kept open between calls, and closed by end_image()
+            self._interlace_file = tempfile.TemporaryFile()  # noqa: SIM115
+
+    def write_rows(self, rows) -> None:
+        """
+        Write rows of pixels to the image started with begin_image().
+        """
+        assert self._image_rows is not None
+        assert self.encoder is not None
+        for row in rows:
+            assert len(row) == self._image_width
+            assert self._image_rows < self._image_height
+            if self._interlace_file is not None:
+                self._interlace_file.write(bytes(row))
+            else:
+                self.encoder.feed(row)
+            self._image_rows += 1
+
+    def end_image(self) -> None:
+        """
+        Complete the image started with begin_image(). All its rows must have
+        been written.
+        """
+        assert self._image_rows == self._image_height
+        assert self.encoder is not None
+        if self._interlace_file is not None:
+            for y in _get_row_order(0, self._image_height, True):
+                self._interlace_file.seek(y * self._image_width)
+                self.encoder.feed(self._interlace_file.read(self._image_width))
+            self._interlace_file.close()
+            self._interlace_file = None
+        self.encoder.finish()
+        self._image_rows = None
+
+    def _start_image(
+        self,
+        width: int,
+        height: int,
+        depth: int,
+        left: int,
+        top: int,
+        colors: Sequence[tuple[int, int, int]],
+        interlace: bool,
+        store: bool,
+    ) -> LZWEncoder:
         has_color_table = len(colors) > 0
         if has_color_table:
             color_table_size = depth
@@ -92,9 +194,14 @@ class Writer:
         )
         if has_color_table:
             self.write_color_table(colors, depth)
-        encoder = LZWEncoder(self.file, min_code_size=max(depth, 2))
-        encoder.feed(pixels)
-        encoder.finish()
+        if self.encoder is None or self.encoder.file is not self.file:
+            self.encoder = LZWEncoder(
+                self.file, min_code_size=max(depth, 2), store=store
+            )
+        else:
+            self.encoder.store = store
+            self.encoder.reset(max(depth, 2))
+        return self.encoder
 
     def write_image_descriptor(
         self,
@@ -280,5 +387,74 @@ class Writer:
             offset += length
         self.write_extension_trailer()
 
+    def write_raw_block(self, block: Block) -> None:
+        """
+        Copy block as it is, e.g. to write an image without decoding it.
+        """
+        self.file.write(
+            memoryview(block.data)[block.offset : block.offset + block.length]
+        )
+
     def write_trailer(self) -> None:
         self.file.write(struct.pack("B", BlockType.TRAILER))
+
+
+class AnimationBuilder:
+    """
+    Writes an animation from composited frames, each the full screen of
+    pixels. Consecutive identical frames are written as one frame with the sum
+    of their delay times (in hundredths of a second).
+
+    The animation loops loop_count times (forever if 0, not at all if None).
+    """
+
+    def __init__(
+        self,
+        file,
+        width: int,
+        height: int,
+        colors: Sequence[tuple[int, int, int]],
+        loop_count: int | None = 0,
+    ) -> None:
+        assert 0 < len(colors) <= 256
+        self.writer = Writer(file)
+        self.width = width
+        self.height = height
+        self.depth = max((len(colors) - 1).bit_length(), 1)
+        self.n_frames = 0
+        self.n_merged_frames = 0
+
+        # Frame waiting to be written, in case the next one is the same
+        self._pixels: bytes | None = None
+        self._delay_time = 0
+
+        self.writer.write_header()
+        self.writer.write_screen_descriptor(
+            width, height, has_color_table=True, depth=self.depth
+        )
+        self.writer.write_color_table(colors, self.depth)
+        if loop_count is not None:
+            self.writer.write_netscape_extension(loop_count)
+
+    def add_frame(self, pixels, delay_time: int = 0) -> None:
+        assert len(pixels) == self.width * self.height
+        pixels = bytes(pixels)
+        if pixels == self._pixels and self._delay_time + delay_time <= 65535:
+            self._delay_time += delay_time
+            self.n_merged_frames += 1
+            return
+        self._write_frame()
+        self._pixels = pixels
+        self._delay_time = delay_time
+
+    def finish(self) -> None:
+        self._write_frame()
+        self.writer.write_trailer()
+
+    def _write_frame(self) -> None:
+        if self._pixels is None:
+            return
+        self.writer.write_graphic_control_extension(delay_time=self._delay_time)
+        self.writer.write_image(self.width, self.height, self.depth, self._pixels)
+        self.n_frames += 1
+        self._pixels = None